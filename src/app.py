@@ -1,8 +1,10 @@
 import streamlit as st
 from chatbot.chatbot import Chatbot
-from chatbot.memory import Memory
-from chatbot.pdf_handler import extract_text_from_pdf, summarize_pdf
-from chatbot.csv_handler import read_csv, summarize_csv
+from chatbot.llm_registry import get_rag
+from chatbot.csv_query import CSVQueryEngine
+from chatbot.memory import Memory, SQLiteMemoryBackend
+from chatbot.pdf_handler import extract_text_from_pdf, iter_pdf_pages, summarize_pdf
+from chatbot.csv_handler import read_csv, ingest_csv, summarize_csv
 from chatbot.TTS import speak_with_elevenlabs
 from chatbot.STT import SpeechToText
 import sys
@@ -13,6 +15,7 @@ import shutil
 import datetime
 import re
 import time 
+import uuid
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -30,41 +33,55 @@ logger = logging.getLogger(__name__)
 # Calculate project root and recordings directory dynamically
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 RECORDINGS_DIR = os.path.join(PROJECT_ROOT, 'recordings')
+CONVERSATIONS_DB = os.path.join(PROJECT_ROOT, 'conversations.sqlite3')
 
 # Create the recordings directory if it doesn't exist
 os.makedirs(RECORDINGS_DIR, exist_ok=True)
 
+@st.cache_resource
+def load_rag():
+    """Build the RAG pipeline once per server process instead of on every rerun."""
+    started = time.perf_counter()
+    rag = get_rag()
+    logger.info(f"RAG pipeline initialized in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return rag
+
+@st.cache_resource
+def load_memory_backend():
+    """One SQLite conversation store shared by every session served by this process."""
+    return SQLiteMemoryBackend(CONVERSATIONS_DB)
+
 def main():
     st.title("LLM-Powered Chatbot")
     st.write("Ask me anything or upload a document (PDF, CSV, arXiv) for summarization or question-answering.")
 
-    # Initialize STT
-    if 'stt' not in st.session_state:
-        try:
-            st.session_state.stt = SpeechToText(RECORDINGS_DIR)
-            logger.info("STT initialized successfully")
-        except Exception as e:
-            logger.error(f"Error initializing STT: {str(e)}")
-            st.error("Failed to initialize speech recognition. Please refresh the page.")
-            return
-    
     # Initialize recording state
     if 'is_recording' not in st.session_state:
         st.session_state.is_recording = False
 
-    memory = Memory()
+    setup_started = time.perf_counter()
+    # Sessions are identified in the URL so a conversation can be resumed after a restart
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = st.query_params.get("session") or uuid.uuid4().hex
+        st.query_params["session"] = st.session_state.session_id
+    if 'memory' not in st.session_state:
+        st.session_state.memory = Memory(st.session_state.session_id, load_memory_backend())
+    memory = st.session_state.memory
     pdf_handler = {
         "extract_text_from_pdf": extract_text_from_pdf,
+        "iter_pdf_pages": iter_pdf_pages,
         "summarize_pdf": summarize_pdf
     }
     csv_handler = {
         "read_csv": read_csv,
+        "ingest_csv": ingest_csv,
         "summarize_csv": summarize_csv
     }
-    chatbot = Chatbot(memory, pdf_handler, csv_handler)
-
-    if 'conversation' not in st.session_state:
-        st.session_state.conversation = []
+    # Uploaded CSV tables stay resident for the session so questions can be answered by query
+    if 'csv_engine' not in st.session_state:
+        st.session_state.csv_engine = CSVQueryEngine()
+    chatbot = Chatbot(memory, pdf_handler, csv_handler, rag=load_rag(), csv_engine=st.session_state.csv_engine)
+    logger.info(f"Chatbot setup for this rerun took {(time.perf_counter() - setup_started) * 1000:.1f} ms")
 
     # Create a single column layout for text input and voice input
     col1 = st.container()
@@ -91,6 +108,9 @@ def main():
     if st.session_state.is_recording:
         try:
             with st.spinner("Recording... Press Enter to stop"):
+                # Created on first use; the speech model itself is loaded once per process and shared
+                if 'stt' not in st.session_state:
+                    st.session_state.stt = SpeechToText(RECORDINGS_DIR)
                 # Record and transcribe (blocking call)
                 text = st.session_state.stt.listen()
 
@@ -120,8 +140,8 @@ def main():
     # This will run after the rerun triggered by successful recording
     if user_input and not st.session_state.is_recording:
         try:
-            response = chatbot.get_response(user_input)
-            st.session_state.conversation.append({"user": user_input, "bot": response})
+            # Render the answer as it streams in instead of waiting for the full response
+            response = st.write_stream(chatbot.stream_response(user_input))
             cleaned_response = clean_for_tts(response)
             speak_with_elevenlabs(cleaned_response, RECORDINGS_DIR)
             # Clear the text input field after sending
@@ -131,11 +151,12 @@ def main():
             logger.error(f"Error processing user input: {str(e)}")
             st.error("An error occurred while processing your message. Please try again.")
 
-    # Display conversation history
-    if st.session_state.conversation:
+    # Display conversation history (most recent page only)
+    conversation = memory.get_recent_history()
+    if conversation:
         st.write("---")
         st.subheader("Conversation History")
-        for chat in st.session_state.conversation:
+        for chat in conversation:
             st.write(f"You: {chat['user']}")
             st.write(f"Bot: {chat['bot']}")
             st.write("---")
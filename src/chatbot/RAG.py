@@ -1,36 +1,174 @@
 import os
 from dotenv import load_dotenv
-from PyPDF2 import PdfReader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 import google.generativeai as genai
-from langchain_community.vectorstores import FAISS
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.prompts import PromptTemplate
-from langchain.chains.question_answering import load_qa_chain
-from cachetools import LRUCache
+from langchain_core.documents import Document
 import asyncio
-import time
-import google.api_core.exceptions
 import datetime
+import functools
+import logging
+import threading
+from collections import Counter
+from itertools import repeat
+from concurrent.futures import ThreadPoolExecutor
+from .index_manager import get_index_manager
+from .embedding_cache import CachedEmbeddings
+from .embedding_pipeline import embed_texts
+from .embeddings import embedding_id, make_embeddings
+from .response_cache import ResponseCache
+from .llm_registry import get_llm_backend
+from .llm_backends import LLMRouter
+from .event_loop import get_background_loop
+from .summarizer import MapReduceSummarizer
+from .pdf_handler import iter_pdf_pages
+from .tokens import count_tokens, truncate_to_tokens, tail_to_tokens
+from .retrieval import HybridRetriever, CrossEncoderReranker
 
-MAX_TOKEN_LIMIT = 2048
+logger = logging.getLogger(__name__)
+
+MAX_TOKEN_LIMIT = 2048  # per question
+PROMPT_TOKEN_BUDGET = 8000  # whole assembled QA prompt: template, history, context and question
+HISTORY_BUDGET_SHARE = 0.3  # at most this share of the remaining budget goes to history
+MIN_CONTEXT_DOC_TOKENS = 100  # don't bother including a retrieved chunk truncated below this
+RETRIEVAL_K = 3
+RETRIEVAL_MODE = "hybrid"  # "hybrid", "dense" or "lexical" (no network calls for retrieval)
+RETRIEVAL_CANDIDATES = 10  # per retriever, before fusion and reranking
+RERANKER_MODEL = None  # e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2" to rerank on CPU
+INDEX_TYPE = "flat"  # "flat", "ivf_flat", "ivf_pq" (compressed) or "hnsw"; see python -m chatbot.ann
+INDEX_PARAMS = {}  # build options for chatbot.ann.build_index, e.g. {"nlist": 4096, "pq_m": 32}
+INDEX_NPROBE = 16  # IVF lists scanned per query
+INDEX_EF_SEARCH = 64  # HNSW candidate list size per query
+INDEX_MMAP = True  # memory-map served index files instead of reading them into RAM
+EMBEDDING_BACKEND = "google"  # "google" (remote API) or "local" (sentence-transformers on CPU, works offline)
+EMBEDDING_MODEL = "models/embedding-001"  # for "local", e.g. "sentence-transformers/all-MiniLM-L6-v2"
+LOCAL_EMBEDDING_OPTIONS = {"threads": None, "onnx": False, "quantize": False}
+EMBEDDING_CACHE_PATH = "embedding_cache.sqlite3"
+EMBED_PIPELINE = {
+    "google": {"batch_size": 16, "max_in_flight": 4, "requests_per_minute": 120},
+    # One batch at a time: the model already uses every CPU thread
+    "local": {"batch_size": 64, "max_in_flight": 1, "requests_per_minute": None},
+}
+# Ordered routing rules, first reachable match wins; see LLMRouter. For example
+# {"backend": "ollama", "model": "llama3.2:3b", "task": "summary"} sends summaries
+# to a local model, and adding "max_prompt_tokens": 2000 to a "qa" rule keeps
+# only short questions local. The Ollama server is read from OLLAMA_HOST.
+LLM_ROUTES = [
+    {"backend": "gemini", "model": "gemini-2.0-flash"},
+]
+RESPONSE_CACHE_SIZE = 256
+RESPONSE_CACHE_TTL = 3600  # seconds
+# Cosine similarity for serving a cached answer to a reworded question (e.g. 0.95); cached
+# questions must also share every non-stopword term. None disables semantic matching.
+SEMANTIC_CACHE_THRESHOLD = None
+
+QA_PROMPT_TEMPLATE = (
+    "You are a helpful and informative chatbot. Here is the conversation so far:\n"
+    "{history}\n"
+    "If the user asks about their previous questions or conversation history, use the above to answer accurately.\n"
+    "Context:\n{context}\n"
+    "Question:\n{question}\n"
+    "ANSWER:"
+)
+QA_PROMPT = PromptTemplate(
+    template=QA_PROMPT_TEMPLATE, input_variables=["history", "context", "question"]
+)
+SUMMARIZATION_PROMPT = PromptTemplate(
+    template="Summarize the following text:\n\n{text}\n\nSUMMARY:",
+    input_variables=["text"],
+)
 
 class RAG:
     def __init__(self):
         load_dotenv()
         self.api_key = os.getenv("GOOGLE_API_KEY")
         genai.configure(api_key=self.api_key)
-        self.vector_store_path = "faiss_index"
-        self.cache = LRUCache(maxsize=100)
-        self.embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
-
-        # Ensure the vector store directory exists
-        if not os.path.exists(self.vector_store_path):
-            os.makedirs(self.vector_store_path)
+        # Vectors from different models are not comparable, so each backend gets its own index
+        self.vector_store_path = "faiss_index" if EMBEDDING_BACKEND == "google" else f"faiss_index_{EMBEDDING_BACKEND}"
+        self.response_cache = ResponseCache(
+            maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL, similarity_threshold=SEMANTIC_CACHE_THRESHOLD
+        )
+        # Cache vectors on disk so re-ingested chunks and repeated questions skip the model
+        options = LOCAL_EMBEDDING_OPTIONS if EMBEDDING_BACKEND == "local" else {}
+        self.embedding_id = embedding_id(EMBEDDING_BACKEND, EMBEDDING_MODEL)
+        self.embeddings = CachedEmbeddings(
+            make_embeddings(EMBEDDING_BACKEND, EMBEDDING_MODEL, **options), EMBEDDING_CACHE_PATH, self.embedding_id
+        )
+        # Shared across RAG instances so the index is loaded once per process
+        self.index = get_index_manager(
+            self.vector_store_path,
+            self.embeddings,
+            index_type=INDEX_TYPE,
+            index_params=INDEX_PARAMS,
+            search_params={"nprobe": INDEX_NPROBE, "ef_search": INDEX_EF_SEARCH},
+            mmap=INDEX_MMAP,
+            embedding_id=self.embedding_id,
+        )
+        self.summarizer = MapReduceSummarizer(self, SUMMARIZATION_PROMPT)
+        self.retriever = HybridRetriever(
+            self.index,
+            self.embeddings,
+            mode=RETRIEVAL_MODE,
+            k=RETRIEVAL_K,
+            candidates=RETRIEVAL_CANDIDATES,
+            reranker=CrossEncoderReranker(RERANKER_MODEL) if RERANKER_MODEL else None,
+        )
+        self.router = LLMRouter(LLM_ROUTES, get_llm_backend)
+        self.usage = Counter()  # cumulative tokens in/out and request count
+        self._usage_lock = threading.Lock()
+        # Ingestion and embedding get their own threads so they never wait on the event
+        # loop's default pool while holding threads from it (see aget_vector_store)
+        self._ingest_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+        self._embed_executor = ThreadPoolExecutor(
+            max_workers=EMBED_PIPELINE[EMBEDDING_BACKEND]["max_in_flight"], thread_name_prefix="embed"
+        )
 
     def count_tokens(self, text):
-        return len(text.split())
+        return count_tokens(text)
+
+    def fit_prompt(self, user_question, history_str, docs):
+        """Trim history and retrieved docs so the assembled QA prompt fits PROMPT_TOKEN_BUDGET.
+
+        The most recent history is kept, up to HISTORY_BUDGET_SHARE of what the
+        template and question leave free; docs fill the rest in rank order, the
+        last one truncated if needed. Returns (history_str, docs, prompt_tokens).
+        """
+        fixed = count_tokens(QA_PROMPT.format(history="", context="", question=user_question))
+        available = PROMPT_TOKEN_BUDGET - fixed
+        if available <= 0:
+            raise ValueError(f"Question does not fit the prompt budget of {PROMPT_TOKEN_BUDGET} tokens.")
+        history_str = tail_to_tokens(history_str, int(available * HISTORY_BUDGET_SHARE))
+        remaining = available - count_tokens(history_str)
+
+        kept = []
+        for doc in docs:
+            tokens = count_tokens(doc.page_content) + 1  # blank-line separator
+            if tokens <= remaining:
+                kept.append(doc)
+                remaining -= tokens
+                continue
+            if remaining >= MIN_CONTEXT_DOC_TOKENS:
+                kept.append(Document(
+                    page_content=truncate_to_tokens(doc.page_content, remaining - 1), metadata=doc.metadata
+                ))
+            break
+        prompt_tokens = count_tokens(self.format_qa_prompt(user_question, history_str, kept))
+        return history_str, kept, prompt_tokens
+
+    def format_qa_prompt(self, user_question, history_str, docs):
+        # Same prompt the "stuff" chain assembles, so streamed and plain answers match
+        return QA_PROMPT.format(
+            history=history_str,
+            context="\n\n".join(doc.page_content for doc in docs),
+            question=user_question,
+        )
+
+    def record_usage(self, kind, tokens_in, tokens_out):
+        with self._usage_lock:
+            self.usage["requests"] += 1
+            self.usage["tokens_in"] += tokens_in
+            self.usage["tokens_out"] += tokens_out
+        logger.info(f"{kind} request: {tokens_in} tokens in, {tokens_out} tokens out")
 
     def enforce_token_limit(self, text):
         if self.count_tokens(text) > MAX_TOKEN_LIMIT:
@@ -39,80 +177,102 @@ class RAG:
             )
 
     def get_pdf_text(self, pdf_docs):
-        text = ""
-        for pdf in pdf_docs:
-            pdf_reader = PdfReader(pdf)
-            for page in pdf_reader.pages:
-                text += page.extract_text()
-        return text
-
-    def get_text_chunks(self, text):
-        splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=500)
+        return "".join(text for pdf in pdf_docs for _, text in iter_pdf_pages(pdf))
+
+    def get_text_chunks(self, text, chunk_size=2000, chunk_overlap=500):
+        splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
         return splitter.split_text(text)
 
-    def get_vector_store(self, chunks):
-        batch_size = 16
-        vector_store = None
-
-        for i in range(0, len(chunks), batch_size):
-            if vector_store is None:
-                vector_store = self.create_faiss_index(chunks[i:i+batch_size])
-            else:
-                new_vector_store = self.create_faiss_index(chunks[i:i+batch_size])
-                vector_store.merge_from(new_vector_store)
-        vector_store.save_local(self.vector_store_path)
-
-    def create_faiss_index(self, texts):
-        retries = 3
-        for attempt in range(retries):
-            try:
-                return FAISS.from_texts(texts, embedding=self.embeddings)
-            except google.api_core.exceptions.ResourceExhausted as e:
-                if attempt < retries - 1:
-                    time.sleep(60)  # Wait for 60 seconds before retrying
-                else:
-                    raise e
-
-    def get_conversational_chain(self):
-        prompt_template = (
-            "You are a helpful and informative chatbot. Here is the conversation so far:\n"
-            "{history}\n"
-            "If the user asks about their previous questions or conversation history, use the above to answer accurately.\n"
-            "Context:\n{context}\n"
-            "Question:\n{question}\n"
-            "ANSWER:"
+    def chunk_pages(self, pages):
+        """Chunk (page_number, text) pairs as they are produced, tagging each chunk with its page.
+
+        Returns the full text plus the chunks and their metadata.
+        """
+        splitter = RecursiveCharacterTextSplitter(chunk_size=2000, chunk_overlap=500)
+        texts, chunks, metadatas = [], [], []
+        for page_number, text in pages:
+            texts.append(text)
+            for chunk in splitter.split_text(text):
+                chunks.append(chunk)
+                metadatas.append({"page": page_number})
+        return "\n".join(texts).strip(), chunks, metadatas
+
+    async def aget_vector_store(self, chunks, document_id="default", metadatas=None):
+        """get_vector_store on the ingestion thread.
+
+        Uploads are serialized by the index anyway; queueing them on one
+        dedicated thread keeps waiting uploads from holding threads of the
+        event loop's default pool, which questions and embedding need.
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            self._ingest_executor, functools.partial(self.get_vector_store, chunks, document_id, metadatas)
         )
 
-        model = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0.5)
-        prompt = PromptTemplate(
-            template=prompt_template, input_variables=["history", "context", "question"]
+    def get_vector_store(self, chunks, document_id="default", metadatas=None):
+        """Add a document's chunks to the index, replacing the chunks it owned before.
+
+        chunks and metadatas may be iterators; they are consumed as they are indexed.
+        """
+        metadatas = ({**metadata, "source": document_id} for metadata in (metadatas or repeat({})))
+        return self.index.update_document(document_id, chunks, self.embed_chunks, metadatas)
+
+    def delete_document(self, document_id):
+        return self.index.delete_document(document_id)
+
+    def embed_chunks(self, chunks):
+        """Embed chunks concurrently, returning one vector per chunk.
+
+        Called from IndexManager.update_document on a worker thread, so the
+        pipeline is handed to the shared background event loop. Its batches
+        run on a dedicated pool: this thread blocks until they finish, and
+        it may itself be one of the loop's default pool threads.
+        """
+        return get_background_loop().run(
+            embed_texts(self.embeddings, chunks, executor=self._embed_executor, **EMBED_PIPELINE[EMBEDDING_BACKEND])
         )
-        chain = load_qa_chain(model, chain_type="stuff", prompt=prompt)
-        return chain
-
-    def cached_user_input(self, user_question):
-        if user_question in self.cache:
-            return self.cache[user_question]
-        else:
-            answer = self.user_input(user_question)
-            self.cache[user_question] = answer
+
+    async def lookup_cached_answer(self, user_question, history_str=""):
+        """Return (scope, query_vector, answer) where answer is None on a cache miss."""
+        generation = self.index.read_generation()
+        if generation is None:
+            raise FileNotFoundError("FAISS index not found. Please upload documents to create the index.")
+        scope = self.response_cache.scope(generation, history_str)
+        answer = self.response_cache.get(user_question, scope)
+        if answer is not None:
+            return scope, None, answer
+
+        query_vector = None
+        if SEMANTIC_CACHE_THRESHOLD is not None and RETRIEVAL_MODE != "lexical":
+            # Served from the embedding cache again when dense retrieval embeds the question
+            query_vector = await asyncio.to_thread(self.embeddings.embed_query, user_question)
+        return scope, query_vector, self.response_cache.get_similar(user_question, query_vector, scope)
+
+    async def cached_user_input(self, user_question, history_str=""):
+        """Answer a question, serving repeated (or near-identical) questions from the response cache."""
+        scope, query_vector, answer = await self.lookup_cached_answer(user_question, history_str)
+        if answer is not None:
             return answer
 
+        answer = await self.generate_answer(user_question, history_str)
+        self.response_cache.put(user_question, scope, answer, query_vector)
+        return answer
+
+    async def retrieve(self, user_question):
+        # Raises FileNotFoundError until documents have been uploaded
+        return await asyncio.to_thread(self.retriever.retrieve, user_question)
+
+    async def generate_answer(self, user_question, history_str=""):
+        docs = await self.retrieve(user_question)
+        history_str, docs, prompt_tokens = self.fit_prompt(user_question, history_str, docs)
+        prompt = self.format_qa_prompt(user_question, history_str, docs)
+        backend, answer = await self.router.complete("qa", prompt, prompt_tokens)
+        self.record_usage(f"QA ({backend.label})", prompt_tokens, count_tokens(answer))
+        return answer
+
     async def user_input(self, user_question, history_str=""):
         try:
             self.enforce_token_limit(user_question)
-            # Check if the FAISS index exists, if not create it
-            if not os.path.exists(os.path.join(self.vector_store_path, "index.faiss")):
-                raise FileNotFoundError("FAISS index not found. Please upload documents to create the index.")
-            new_db = FAISS.load_local(self.vector_store_path, self.embeddings, allow_dangerous_deserialization=True)
-            docs = await asyncio.to_thread(new_db.similarity_search, user_question, k=3)
-            chain = self.get_conversational_chain()
-            response = await asyncio.to_thread(
-                chain,
-                {"input_documents": docs, "question": user_question, "context": "", "history": history_str},
-                return_only_outputs=True
-            )
-            return response["output_text"]
+            return await self.cached_user_input(user_question, history_str)
 
         except ValueError as ve:
             return f"Validation error: {ve}"
@@ -121,11 +281,43 @@ class RAG:
         except Exception as e:
             return f"An unexpected error occurred: {e}"
 
+    async def stream_user_input(self, user_question, history_str=""):
+        """Yield the answer piece by piece as the model generates it.
+
+        Cached answers are yielded in one piece; errors are yielded as messages,
+        matching what user_input returns.
+        """
+        try:
+            self.enforce_token_limit(user_question)
+            scope, query_vector, answer = await self.lookup_cached_answer(user_question, history_str)
+            if answer is not None:
+                yield answer
+                return
+
+            docs = await self.retrieve(user_question)
+            history_str, docs, prompt_tokens = self.fit_prompt(user_question, history_str, docs)
+            prompt = self.format_qa_prompt(user_question, history_str, docs)
+            parts = []
+            backend = None
+            async for backend, piece in self.router.stream("qa", prompt, prompt_tokens):
+                parts.append(piece)
+                yield piece
+            answer = "".join(parts)
+            self.record_usage(f"QA ({backend.label if backend else 'no output'})", prompt_tokens, count_tokens(answer))
+            self.response_cache.put(user_question, scope, answer, query_vector)
+
+        except ValueError as ve:
+            yield f"Validation error: {ve}"
+        except FileNotFoundError as fnfe:
+            yield str(fnfe)
+        except Exception as e:
+            yield f"An unexpected error occurred: {e}"
+
     async def main(self, pdf_docs, user_question):
         try:
             text = self.get_pdf_text(pdf_docs)
             chunks = self.get_text_chunks(text)
-            self.get_vector_store(chunks)
+            await self.aget_vector_store(chunks)
             answer = await self.cached_user_input(user_question)
             return answer
         except ValueError as ve:
@@ -136,26 +328,24 @@ class RAG:
     async def model(self, pdf_docs, user_question):
         return await self.main([pdf_docs], user_question)
 
+    async def run_prompt(self, prompt, task="prompt", **variables):
+        """Run prompt on the backend LLM_ROUTES picks for task and return the stripped text."""
+        text = prompt.format(**variables)
+        prompt_tokens = count_tokens(text)
+        backend, response = await self.router.complete(task, text, prompt_tokens)
+        response = response.strip()
+        self.record_usage(f"{task.capitalize()} ({backend.label})", prompt_tokens, count_tokens(response))
+        return response
+
     async def summarize(self, text):
-        """Generate a summary of the given text using the LLM."""
+        """Generate a summary of the given text using the LLM.
+
+        Large texts are summarized map-reduce style so they never exceed the
+        model's context window.
+        """
         try:
-            # Use a simple prompt for summarization
-            summarization_prompt = PromptTemplate(
-                template="Summarize the following text:\n\n{text}\n\nSUMMARY:",
-                input_variables=["text"],
-            )
-            
-            # Use the configured Google Gemini model
-            model = ChatGoogleGenerativeAI(model="gemini-2.0-flash", temperature=0.5)
-            
-            # Create a simple chain for summarization
-            chain = summarization_prompt | model
-            
-            # Run the summarization chain in a separate thread
-            response = await asyncio.to_thread(chain.invoke, {"text": text})
-            
-            return response.content.strip()
+            return await self.summarizer.summarize(text)
         except Exception as e:
             # Log the error and return an informative message
             print(f"Error during summarization: {e}") # Consider using logger here
-            return "An error occurred while generating the summary."
\ No newline at end of file
+            return "An error occurred while generating the summary."
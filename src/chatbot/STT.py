@@ -1,11 +1,9 @@
-import whisper
-import sounddevice as sd
 import numpy as np
 import scipy.io.wavfile as wav
 import wave
 import os
+import json
 import tempfile
-import keyboard
 import threading
 import queue
 import time
@@ -13,6 +11,9 @@ import warnings
 import logging
 import shutil
 import datetime
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -25,24 +26,254 @@ warnings.filterwarnings("ignore", message="FP16 is not supported on CPU")
 # RECORDINGS_DIR = r"C:/Courses/Sem 6/Selected Topics In Ai/Selected proj/llm-chatbot-app/recordings"
 # os.makedirs(RECORDINGS_DIR, exist_ok=True)
 
+VAD_FRAME_MS = 30
+VAD_ENERGY_THRESHOLD = 0.01  # minimum RMS of a speech frame (float32 samples in [-1, 1])
+VAD_MIN_SPEECH_MS = 250  # segments with less speech than this are dropped as noise
+VAD_SILENCE_MS = 600  # this much silence ends a segment
+VAD_PADDING_MS = 200  # audio kept before speech starts so the first syllable is not clipped
+MAX_SEGMENT_SECONDS = 15  # long utterances are cut so partial results keep flowing
+
+STT_BACKEND = os.getenv("STT_BACKEND", "whisper")  # "whisper" (openai-whisper, FP32) or "faster-whisper" (CTranslate2)
+STT_MODEL_SIZE = os.getenv("STT_MODEL_SIZE", "base")
+STT_COMPUTE_TYPE = "int8"  # faster-whisper only
+STT_THREADS = int(os.getenv("STT_THREADS", "0"))  # 0 lets the backend pick
+STT_BEAM_SIZE = 1  # greedy decoding; raise for accuracy at the cost of latency
+
+
+class WhisperBackend:
+    """openai-whisper on CPU in FP32."""
+
+    name = "whisper"
+
+    def __init__(self, model_size=STT_MODEL_SIZE, threads=STT_THREADS, beam_size=STT_BEAM_SIZE):
+        import torch
+        import whisper
+        if threads:
+            torch.set_num_threads(threads)
+        self.beam_size = beam_size
+        self.model = whisper.load_model(model_size, device="cpu")
+        # One PyTorch model shared by every session; CPU inference is serialized
+        self._lock = threading.Lock()
+
+    def transcribe(self, audio, prompt=None):
+        """Transcribe a file path or mono float32 samples at 16 kHz."""
+        options = {"beam_size": self.beam_size} if self.beam_size > 1 else {}
+        with self._lock:
+            result = self.model.transcribe(
+                audio,
+                fp16=False,  # Force FP32 for CPU
+                language="en",  # Specify language for better accuracy
+                initial_prompt=prompt,
+                condition_on_previous_text=False,
+                **options,
+            )
+        return result["text"].strip()
+
+
+class FasterWhisperBackend:
+    """faster-whisper (CTranslate2) with int8-quantized weights on CPU."""
+
+    name = "faster-whisper"
+
+    def __init__(self, model_size=STT_MODEL_SIZE, threads=STT_THREADS, beam_size=STT_BEAM_SIZE,
+                 compute_type=STT_COMPUTE_TYPE):
+        from faster_whisper import WhisperModel
+        self.beam_size = beam_size
+        self.model = WhisperModel(model_size, device="cpu", compute_type=compute_type, cpu_threads=threads)
+
+    def transcribe(self, audio, prompt=None):
+        segments, _ = self.model.transcribe(
+            audio,
+            language="en",
+            beam_size=self.beam_size,
+            initial_prompt=prompt,
+            condition_on_previous_text=False,
+        )
+        # Segments are decoded lazily as the generator is consumed
+        return "".join(segment.text for segment in segments).strip()
+
+
+STT_BACKENDS = {"whisper": WhisperBackend, "faster-whisper": FasterWhisperBackend}
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def get_stt_backend(name=None, **options):
+    """Return the process-wide speech recognition backend, loading its model on first use."""
+    name = name or STT_BACKEND
+    key = (name, tuple(sorted(options.items())))
+    with _backends_lock:
+        if key not in _backends:
+            started = time.perf_counter()
+            _backends[key] = STT_BACKENDS[name](**options)
+            logger.info(f"Loaded {name} speech model in {time.perf_counter() - started:.1f}s")
+        return _backends[key]
+
+
+def load_wav(path, sample_rate=16000, mmap=False):
+    """Read a WAV file as mono float32 samples in [-1, 1] at sample_rate.
+
+    With mmap the file is mapped rather than read, so only one converted copy
+    of the samples is ever held in memory.
+    """
+    try:
+        rate, data = wav.read(path, mmap=mmap)
+    except ValueError:
+        # Formats such as 24-bit PCM cannot be memory-mapped
+        rate, data = wav.read(path)
+    if data.dtype == np.int16:
+        data = data.astype(np.float32) / 32768.0
+    elif data.dtype == np.int32:
+        data = data.astype(np.float32) / 2147483648.0
+    elif data.dtype == np.uint8:
+        data = (data.astype(np.float32) - 128.0) / 128.0
+    else:
+        data = data.astype(np.float32, copy=False)
+    if data.ndim > 1:
+        data = data.mean(axis=1)
+    if rate != sample_rate:
+        from scipy.signal import resample_poly
+        divisor = np.gcd(rate, sample_rate)
+        data = resample_poly(data, sample_rate // divisor, rate // divisor).astype(np.float32)
+    return data
+
+
+class EnergyVAD:
+    """Splits a stream of audio blocks into speech segments by frame energy.
+
+    The threshold adapts to the background: it is the larger of threshold and
+    three times the running noise floor measured between segments.
+    """
+
+    def __init__(self, sample_rate=16000, frame_ms=VAD_FRAME_MS, threshold=VAD_ENERGY_THRESHOLD,
+                 min_speech_ms=VAD_MIN_SPEECH_MS, silence_ms=VAD_SILENCE_MS, padding_ms=VAD_PADDING_MS,
+                 max_segment_seconds=MAX_SEGMENT_SECONDS):
+        self.frame_size = int(sample_rate * frame_ms / 1000)
+        self.threshold = threshold
+        self.min_speech_frames = min_speech_ms // frame_ms
+        self.silence_frames = silence_ms // frame_ms
+        self.max_frames = int(max_segment_seconds * 1000 / frame_ms)
+        self.noise_floor = None
+        self._pending = np.zeros(0, dtype=np.float32)
+        self._preroll = deque(maxlen=max(1, padding_ms // frame_ms))
+        self._segment = []
+        self._speech_frames = 0
+        self._silent_frames = 0
+
+    def _is_speech(self, energy):
+        threshold = self.threshold
+        if self.noise_floor is not None:
+            threshold = max(threshold, 3 * self.noise_floor)
+        return energy > threshold
+
+    def process(self, samples):
+        """Feed mono float32 samples; return the speech segments completed by them."""
+        samples = np.concatenate([self._pending, samples.reshape(-1).astype(np.float32, copy=False)])
+        usable = len(samples) - len(samples) % self.frame_size
+        self._pending = samples[usable:]
+        segments = []
+        for frame in samples[:usable].reshape(-1, self.frame_size):
+            energy = float(np.sqrt(np.mean(frame ** 2)))
+            speech = self._is_speech(energy)
+            if not self._segment:
+                if speech:
+                    self._segment = list(self._preroll) + [frame]
+                    self._speech_frames = 1
+                    self._silent_frames = 0
+                else:
+                    self._preroll.append(frame)
+                    self.noise_floor = energy if self.noise_floor is None else 0.95 * self.noise_floor + 0.05 * energy
+                continue
+            self._segment.append(frame)
+            if speech:
+                self._speech_frames += 1
+                self._silent_frames = 0
+            else:
+                self._silent_frames += 1
+            if self._silent_frames >= self.silence_frames or len(self._segment) >= self.max_frames:
+                segment = self._close()
+                if segment is not None:
+                    segments.append(segment)
+        return segments
+
+    def flush(self):
+        """Return the segment in progress, if it holds enough speech, once input has ended."""
+        return self._close() if self._segment else None
+
+    def _close(self):
+        frames, speech_frames = self._segment, self._speech_frames
+        self._segment = []
+        self._speech_frames = 0
+        self._silent_frames = 0
+        self._preroll.clear()
+        if speech_frames < self.min_speech_frames:
+            return None
+        return np.concatenate(frames)
+
+
+class StreamingTranscription:
+    """Transcribes speech segments on a worker thread as they arrive.
+
+    Segments are transcribed in order, each prompted with the text so far for
+    continuity; on_partial(text) is called with the running hypothesis after
+    every segment.
+    """
+
+    def __init__(self, transcribe, on_partial=None, sample_rate=16000):
+        self._transcribe = transcribe
+        self.sample_rate = sample_rate
+        self._on_partial = on_partial
+        self._segments = queue.Queue()
+        self.texts = []
+        self.segments = 0  # speech segments received
+        self._worker = threading.Thread(target=self._run, name="stt-transcribe", daemon=True)
+        self._worker.start()
+
+    @property
+    def text(self):
+        return " ".join(self.texts)
+
+    def add(self, segment):
+        self.segments += 1
+        self._segments.put(segment)
+
+    def _run(self):
+        while True:
+            segment = self._segments.get()
+            if segment is None:
+                return
+            started = time.perf_counter()
+            text = self._transcribe(segment, prompt=self.text or None)
+            logger.info(
+                f"Transcribed {len(segment) / self.sample_rate:.1f}s segment in {time.perf_counter() - started:.2f}s"
+            )
+            if text:
+                self.texts.append(text)
+                if self._on_partial:
+                    self._on_partial(self.text)
+
+    def finish(self):
+        """Wait for every queued segment and return the full transcript."""
+        self._segments.put(None)
+        self._worker.join()
+        return self.text
+
+
 class SpeechToText:
-    def __init__(self, recordings_dir):
-        logger.info("Initializing SpeechToText...")
-        try:
-            # Initialize Whisper model with CPU-optimized settings
-            self.model = whisper.load_model("base", device="cpu")
-            logger.info("Whisper model loaded successfully")
-        except Exception as e:
-            logger.error(f"Error loading Whisper model: {str(e)}")
-            raise
-        
+    def __init__(self, recordings_dir, backend=None):
+        # The speech model is shared process-wide and only loaded on first transcription
+        self.backend_name = backend
         self.sample_rate = 16000
         self.channels = 1
         self.recording = False
         self.audio_queue = queue.Queue()
         self.recording_thread = None
         self.recordings_dir = recordings_dir
-        
+
+    @property
+    def backend(self):
+        return get_stt_backend(self.backend_name)
+
     def record_audio(self):
         """Record audio until user presses Enter"""
         logger.info("Starting audio recording...")
@@ -53,6 +284,10 @@ class SpeechToText:
                 logger.warning(f"Audio callback status: {status}")
             self.audio_queue.put(indata.copy())
         
+        # Audio and keyboard libraries need a device, so batch transcription does not import them
+        import sounddevice as sd
+        import keyboard
+
         # Start recording
         self.recording = True
         try:
@@ -112,20 +347,103 @@ class SpeechToText:
                 logger.error(f"Audio file {audio_file} is empty")
                 return None
 
-            # Use CPU-optimized settings for transcription
-            result = self.model.transcribe(
-                audio_file,
-                fp16=False,  # Force FP32 for CPU
-                language="en"  # Specify language for better accuracy
-            )
+            text = self.backend.transcribe(audio_file)
             logger.info("Transcription completed successfully")
-            return result["text"].strip()
+            return text
         except Exception as e:
             logger.error(f"Error during transcription: {str(e)}")
             return None
 
-    def listen(self):
+    def transcribe_array(self, samples, prompt=None):
+        """Transcribe mono float32 samples at 16 kHz without going through a file."""
+        try:
+            return self.backend.transcribe(samples.astype(np.float32, copy=False), prompt=prompt)
+        except Exception as e:
+            logger.error(f"Error during transcription: {str(e)}")
+            return None
+
+    def _save_recording(self, audio_data):
+        timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+        recording_path = os.path.join(self.recordings_dir, f"recording_{timestamp}.wav")
+        wav.write(recording_path, self.sample_rate, audio_data)
+        logger.info(f"Saved a copy of the recording at: {recording_path}")
+
+    def listen_streaming(self, on_partial=None, stop_event=None):
+        """Record until Enter (or stop_event), transcribing speech segments while recording continues.
+
+        Microphone blocks go through an EnergyVAD; each finished segment is
+        handed to Whisper on a worker thread as a numpy buffer, and
+        on_partial(text) receives the transcript so far. Returns the final
+        transcript ("" if the speech could not be transcribed), or None if no
+        audio was recorded or it contained no speech.
+        """
+        logger.info("Starting streaming recording...")
+        print("🎤 Recording... Press Enter to stop")
+        vad = EnergyVAD(self.sample_rate)
+        transcription = StreamingTranscription(self.transcribe_array, on_partial, self.sample_rate)
+        recorded = []
+
+        def audio_callback(indata, frames, time_info, status):
+            if status:
+                logger.warning(f"Audio callback status: {status}")
+            self.audio_queue.put(indata[:, 0].copy())
+
+        def drain():
+            while True:
+                try:
+                    block = self.audio_queue.get_nowait()
+                except queue.Empty:
+                    return
+                recorded.append(block)
+                for segment in vad.process(block):
+                    transcription.add(segment)
+
+        import sounddevice as sd
+        import keyboard
+
+        self.recording = True
+        try:
+            with sd.InputStream(samplerate=self.sample_rate,
+                                channels=self.channels,
+                                dtype="float32",
+                                callback=audio_callback,
+                                blocksize=1024):
+                while self.recording:
+                    if keyboard.is_pressed('enter') or (stop_event is not None and stop_event.is_set()):
+                        self.recording = False
+                        print("⏹️ Recording stopped")
+                    drain()
+                    time.sleep(0.05)
+        except Exception as e:
+            logger.error(f"Error during recording: {str(e)}")
+            self.recording = False
+        drain()
+        tail = vad.flush()
+        if tail is not None:
+            transcription.add(tail)
+        text = transcription.finish()
+
+        if recorded:
+            try:
+                self._save_recording(np.concatenate(recorded))
+            except Exception as e:
+                logger.warning(f"Could not save the recording: {str(e)}")
+        if not transcription.segments:
+            logger.warning("No speech recorded")
+            return None
+        return text
+
+    def listen(self, streaming=True, on_partial=None):
         """Main function to record and transcribe audio"""
+        if streaming:
+            try:
+                transcription = self.listen_streaming(on_partial=on_partial)
+                if transcription is None:
+                    return "No audio recorded."
+                return transcription if transcription else "Could not transcribe audio."
+            except Exception as e:
+                logger.error(f"Error in listen function: {str(e)}")
+                return "An error occurred during speech recognition."
         try:
             # Record audio
             audio_data = self.record_audio()
@@ -169,8 +487,154 @@ class SpeechToText:
             logger.error(f"Error in listen function: {str(e)}")
             return "An error occurred during speech recognition."
 
+def benchmark_rtf(paths, backends=tuple(STT_BACKENDS), **options):
+    """Real-time factor (processing time / audio duration) of each backend on each WAV file.
+
+    Model loading is timed separately and excluded from the factor.
+    """
+    audio = [(path, load_wav(path)) for path in paths]
+    rows = []
+    for name in backends:
+        started = time.perf_counter()
+        backend = STT_BACKENDS[name](**options)
+        load_seconds = time.perf_counter() - started
+        for path, samples in audio:
+            started = time.perf_counter()
+            text = backend.transcribe(samples)
+            elapsed = time.perf_counter() - started
+            duration = len(samples) / 16000
+            rows.append({"backend": name, "file": os.path.basename(path), "audio_seconds": duration,
+                         "seconds": elapsed, "rtf": elapsed / duration if duration else 0.0,
+                         "load_seconds": load_seconds, "text": text})
+    return rows
+
+
+BATCH_OUTPUT_FILE = "transcripts.jsonl"
+_batch_backend = None
+
+
+def _init_batch_worker(name, options):
+    # Each worker process loads its own model once and reuses it for every file
+    global _batch_backend
+    _batch_backend = STT_BACKENDS[name](**options)
+
+
+def _transcribe_file(directory, relative_path):
+    """Worker: transcribe one WAV file and return its JSONL record."""
+    started = time.perf_counter()
+    samples = load_wav(os.path.join(directory, relative_path), mmap=True)
+    loaded = time.perf_counter()
+    text = _batch_backend.transcribe(samples)
+    finished = time.perf_counter()
+    duration = len(samples) / 16000
+    return {
+        "file": relative_path,
+        "text": text,
+        "audio_seconds": round(duration, 3),
+        "load_seconds": round(loaded - started, 3),
+        "transcribe_seconds": round(finished - loaded, 3),
+        "rtf": round((finished - loaded) / duration, 3) if duration else 0.0,
+    }
+
+
+def completed_files(output_path):
+    """Files already transcribed successfully according to an existing JSONL output."""
+    done = set()
+    try:
+        with open(output_path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a line cut short by an interrupted run
+                if "error" not in record:
+                    done.add(record["file"])
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def transcribe_directory(directory, output_path=None, backend=None, workers=None, threads=1, **options):
+    """Transcribe every WAV file under directory into a JSONL file, one record per file.
+
+    Files already in output_path are skipped, so an interrupted run resumes
+    where it stopped; failed files are recorded with an "error" and retried
+    next time. Each of workers processes (default: cores / threads) loads
+    the backend once with threads CPU threads. Returns (transcribed, failed, skipped).
+    """
+    output_path = output_path or os.path.join(directory, BATCH_OUTPUT_FILE)
+    paths = sorted(
+        os.path.relpath(os.path.join(root, name), directory)
+        for root, _, names in os.walk(directory)
+        for name in names if name.lower().endswith(".wav")
+    )
+    done = completed_files(output_path)
+    todo = [path for path in paths if path not in done]
+    workers = workers or max(1, (os.cpu_count() or 1) // max(threads, 1))
+    logger.info(f"Transcribing {len(todo)} files ({len(paths) - len(todo)} already done) with {workers} workers")
+    if not todo:
+        return 0, 0, len(paths)
+
+    transcribed = failed = 0
+    started = time.perf_counter()
+    # Spawned rather than forked so workers start clean of the parent's threads
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(todo)),
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_batch_worker,
+        initargs=(backend or STT_BACKEND, {"threads": threads, **options}),
+    ) as executor, open(output_path, "a") as out:
+        futures = {executor.submit(_transcribe_file, directory, path): path for path in todo}
+        for future in as_completed(futures):
+            try:
+                record = future.result()
+                transcribed += 1
+            except Exception as e:
+                record = {"file": futures[future], "error": str(e)}
+                failed += 1
+                logger.error(f"Could not transcribe {futures[future]}: {e}")
+            out.write(json.dumps(record) + "\n")
+            out.flush()  # every finished file survives an interruption
+    logger.info(f"Transcribed {transcribed} files ({failed} failed) in {time.perf_counter() - started:.1f}s")
+    return transcribed, failed, len(paths) - len(todo)
+
+
 def main():
-    stt = SpeechToText()
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Live speech-to-text, batch transcription of a directory, or a benchmark of the backends."
+    )
+    parser.add_argument("--benchmark", nargs="+", metavar="WAV", help="report the real-time factor on these files")
+    parser.add_argument("--backends", nargs="+", default=list(STT_BACKENDS), choices=list(STT_BACKENDS))
+    parser.add_argument("--batch", metavar="DIR", help="transcribe every WAV file under DIR")
+    parser.add_argument("--output", help=f"JSONL output for --batch (default DIR/{BATCH_OUTPUT_FILE})")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes for --batch")
+    parser.add_argument("--backend", default=STT_BACKEND, choices=list(STT_BACKENDS), help="backend for --batch and live mode")
+    parser.add_argument("--recordings-dir", default="recordings", help="where live recordings are saved")
+    parser.add_argument("--model-size", default=STT_MODEL_SIZE)
+    parser.add_argument("--threads", type=int, default=STT_THREADS)
+    parser.add_argument("--beam-size", type=int, default=STT_BEAM_SIZE)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        rows = benchmark_rtf(args.benchmark, args.backends, model_size=args.model_size,
+                             threads=args.threads, beam_size=args.beam_size)
+        print(f"{'backend':<16}{'file':<32}{'audio s':>9}{'proc s':>9}{'RTF':>7}{'load s':>8}")
+        for row in rows:
+            print(f"{row['backend']:<16}{row['file'][:31]:<32}{row['audio_seconds']:>9.1f}"
+                  f"{row['seconds']:>9.2f}{row['rtf']:>7.2f}{row['load_seconds']:>8.1f}")
+        return
+
+    if args.batch:
+        transcribed, failed, skipped = transcribe_directory(
+            args.batch, args.output, args.backend, args.workers, threads=max(args.threads, 1),
+            model_size=args.model_size, beam_size=args.beam_size,
+        )
+        print(f"Transcribed {transcribed} files, {failed} failed, {skipped} already done.")
+        return
+
+    os.makedirs(args.recordings_dir, exist_ok=True)
+    stt = SpeechToText(args.recordings_dir, backend=args.backend)
     print("Speech-to-Text System Ready!")
     print("Press Enter to start recording, then press Enter again to stop.")
     
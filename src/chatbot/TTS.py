@@ -1,25 +1,214 @@
-import whisper
-import sounddevice as sd
-import numpy as np
-import scipy.io.wavfile as wav
-import wave
 import os
+import re
+import json
+import queue
+import hashlib
+import threading
 import traceback
-import sys
-import google.generativeai as genai
-import requests
 from io import BytesIO
-import tempfile
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
 import pygame
-import time
-import re
-import datetime
 from dotenv import load_dotenv
 
 load_dotenv()
 
 ELEVENLABS_API_KEY = os.getenv("ELEVENLABS_API_KEY")
-VOICE_ID = "pqHfZKP75CvOlQylNhV4"  
+# Overridable so the pipeline can be exercised against a local stub server
+ELEVENLABS_BASE_URL = os.getenv("ELEVENLABS_BASE_URL", "https://api.elevenlabs.io")
+VOICE_ID = "pqHfZKP75CvOlQylNhV4"
+MODEL_ID = "eleven_turbo_v2"
+VOICE_SETTINGS = {"stability": 0.5, "similarity_boost": 0.7}
+MAX_CONCURRENT_SYNTHESIS = 3  # sentences synthesized ahead of the one playing
+MIN_SENTENCE_CHARS = 40  # shorter sentences are merged with the next to save requests
+STREAM_CHUNK_SIZE = 4096
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", "tts_cache")
+TTS_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+def split_sentences(text):
+    """Split text into sentences, merging fragments shorter than MIN_SENTENCE_CHARS.
+
+    The first sentence is never merged forward, so speech can start as soon as
+    it is synthesized.
+    """
+    sentences = []
+    for sentence in _SENTENCE_END.split(text.strip()):
+        if not sentence:
+            continue
+        if len(sentences) > 1 and len(sentences[-1]) < MIN_SENTENCE_CHARS:
+            sentences[-1] = f"{sentences[-1]} {sentence}"
+        else:
+            sentences.append(sentence)
+    return sentences
+
+
+def _create_session():
+    session = requests.Session()
+    # One pooled keep-alive connection per concurrent synthesis request
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENT_SYNTHESIS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({
+        "xi-api-key": ELEVENLABS_API_KEY or "",
+        "Content-Type": "application/json",
+        "accept": "audio/mpeg",
+    })
+    return session
+
+
+def synthesize(session, text):
+    """Synthesize text with the streaming endpoint and return the MP3 bytes."""
+    url = f"{ELEVENLABS_BASE_URL}/v1/text-to-speech/{VOICE_ID}/stream"
+    data = {"text": text, "model_id": MODEL_ID, "voice_settings": VOICE_SETTINGS}
+    buffer = BytesIO()
+    with session.post(url, json=data, stream=True, timeout=(5, 60)) as response:
+        if response.status_code != 200:
+            raise RuntimeError(f"ElevenLabs API Error {response.status_code}: {response.text}")
+        for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+            buffer.write(chunk)
+    buffer.seek(0)
+    return buffer
+
+
+class AudioCache:
+    """Synthesized MP3s on disk, addressed by a hash of the text and every voice parameter.
+
+    Files are touched on each hit, and the least recently used are deleted
+    once the directory grows past max_bytes.
+    """
+
+    def __init__(self, directory=TTS_CACHE_DIR, max_bytes=TTS_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.name.endswith(".mp3"))
+
+    @staticmethod
+    def key(text):
+        settings = json.dumps(
+            {"voice_id": VOICE_ID, "model_id": MODEL_ID, "voice_settings": VOICE_SETTINGS}, sort_keys=True
+        )
+        return hashlib.sha256(f"{settings}\0{text}".encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.mp3")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        with self._lock:
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            self._size += len(data) - previous
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        entries = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith(".mp3")),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        # Free down to 90% of the cap so eviction does not run on every put
+        for entry in entries:
+            if self._size <= self.max_bytes * 0.9:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self._size -= size
+            except FileNotFoundError:
+                continue
+
+
+class SpeechPipeline:
+    """Speaks text in the background, sentence by sentence.
+
+    speak() returns immediately. Sentences are synthesized concurrently over a
+    pooled HTTP session while a single worker thread plays them in order from
+    memory, so playback of the first sentence overlaps synthesis of the rest.
+    Sentences found in the AudioCache are not synthesized again. Without an
+    audio device speak() does nothing.
+    """
+
+    def __init__(self, max_concurrent=MAX_CONCURRENT_SYNTHESIS, cache=None):
+        self._session = _create_session()
+        self.cache = cache if cache is not None else AudioCache()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrent, thread_name_prefix="tts")
+        self._utterances = queue.Queue()
+        try:
+            pygame.mixer.init()
+            self.available = True
+        except pygame.error as e:
+            # e.g. a headless server: don't pay for speech nobody can hear
+            print(f"⚠️ No audio output, speech disabled: {str(e)}")
+            self.available = False
+            return
+        self._worker = threading.Thread(target=self._play_loop, name="tts-playback", daemon=True)
+        self._worker.start()
+
+    def speak(self, text):
+        sentences = split_sentences(text)
+        if not sentences or not self.available:
+            return
+        print(f"🔊 Speaking {len(sentences)} sentences with ElevenLabs...")
+        futures = [self._executor.submit(self._synthesize, sentence) for sentence in sentences]
+        self._utterances.put(futures)
+
+    def _synthesize(self, sentence):
+        # Repeated sentences (greetings, error messages, cached answers) cost no API call
+        key = self.cache.key(sentence)
+        data = self.cache.get(key)
+        if data is None:
+            data = synthesize(self._session, sentence).getvalue()
+            self.cache.put(key, data)
+        return BytesIO(data)
+
+    def wait(self):
+        """Block until everything queued so far has been spoken."""
+        self._utterances.join()
+
+    def _play_loop(self):
+        while True:
+            futures = self._utterances.get()
+            try:
+                for future in futures:
+                    play_mp3_buffer(future.result())
+            except Exception as e:
+                print(f"❌ Error with ElevenLabs API: {str(e)}")
+                for future in futures:
+                    future.cancel()
+            finally:
+                self._utterances.task_done()
+
+
+def play_mp3_buffer(buffer):
+    """Play MP3 data from memory on the initialized mixer, returning when playback ends."""
+    pygame.mixer.music.load(buffer, "mp3")
+    pygame.mixer.music.play()
+    clock = pygame.time.Clock()
+    while pygame.mixer.music.get_busy():
+        clock.tick(20)
 
 
 def play_mp3_file(filepath):
@@ -29,7 +218,7 @@ def play_mp3_file(filepath):
         pygame.mixer.init()
         pygame.mixer.music.load(filepath)
         pygame.mixer.music.play()
-        
+
         # Wait for the audio to finish playing
         while pygame.mixer.music.get_busy():
             pygame.time.Clock().tick(10)
@@ -45,41 +234,30 @@ def play_mp3_file(filepath):
         except Exception as e:
             print(f"⚠️ Could not delete temporary MP3 file: {str(e)}")
 
-def speak_with_elevenlabs(text, recordings_dir):
-    print("🔊 Speaking with ElevenLabs...")
+
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+
+def get_speech_pipeline():
+    """Return the process-wide SpeechPipeline, so all sessions share one player and connection pool."""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = SpeechPipeline()
+        return _pipeline
+
+
+def speak_with_elevenlabs(text, recordings_dir=None, wait=False):
+    """Speak text without blocking the caller; pass wait=True to block until it has been spoken.
+
+    recordings_dir is kept for compatibility; audio is no longer written to disk.
+    """
     try:
-        url = f"https://api.elevenlabs.io/v1/text-to-speech/{VOICE_ID}"
-        headers = {
-            "xi-api-key": ELEVENLABS_API_KEY,
-            "Content-Type": "application/json",
-            "accept": "audio/mpeg"  # Request MP3 format instead of WAV
-        }
-
-        data = {
-            "text": text,
-            "model_id": "eleven_turbo_v2",
-            "voice_settings": {"stability": 0.5, "similarity_boost": 0.7}
-        }
-
-        print("Sending request to ElevenLabs API...")
-        response = requests.post(url, json=data, headers=headers)
-        
-        if response.status_code == 200:
-            print("Audio received, saving to file...")
-            
-            # Save to a unique temporary file within the recordings directory
-            temp_file = os.path.join(recordings_dir, f"temp_response_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')}.mp3")
-            with open(temp_file, "wb") as audio_file:
-                audio_file.write(response.content)
-            
-            print(f"✅ Audio saved to {temp_file}")
-            
-            # Play the MP3 file automatically using pygame
-            play_mp3_file(temp_file)
-            
-        else:
-            print(f"❌ ElevenLabs API Error: {response.json()}")
-            
+        pipeline = get_speech_pipeline()
+        pipeline.speak(text)
+        if wait:
+            pipeline.wait()
     except Exception as e:
         print(f"❌ Error with ElevenLabs API: {str(e)}")
-        print(traceback.format_exc())
\ No newline at end of file
+        print(traceback.format_exc())
@@ -0,0 +1,206 @@
+import time
+import math
+import logging
+import argparse
+import numpy as np
+import faiss
+
+logger = logging.getLogger(__name__)
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+MIN_TRAINING_POINTS_PER_LIST = 39  # faiss warns below this many training points per centroid
+MAX_TRAINING_SAMPLE = 256 * 1024
+
+
+def choose_nlist(count):
+    """Roughly 4*sqrt(n) inverted lists, bounded so there is enough data to train them."""
+    return max(1, min(int(4 * math.sqrt(count)), count // MIN_TRAINING_POINTS_PER_LIST))
+
+
+def can_build(index_type, count):
+    """IVF types need enough vectors to train at least a handful of centroids."""
+    if index_type in ("ivf_flat", "ivf_pq"):
+        return count >= MIN_TRAINING_POINTS_PER_LIST * 8
+    return True
+
+
+def build_index(vectors, index_type="flat", nlist=None, pq_m=16, hnsw_m=32, ef_construction=200, seed=0,
+                labels=None):
+    """Build a faiss index of index_type over vectors (n x d float32), training it on a sample first.
+
+    Vectors are stored under labels (int64, default 0..n-1), which search
+    returns and remove_ids takes; flat and hnsw indexes are wrapped in an
+    IndexIDMap for this. Falls back to a flat index when there are too few
+    vectors to train an IVF index.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    count, dim = vectors.shape
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}; expected one of {INDEX_TYPES}")
+    if not can_build(index_type, count):
+        logger.info(f"{count} vectors are too few to train {index_type}, using a flat index")
+        index_type = "flat"
+
+    if index_type == "flat":
+        index = faiss.IndexIDMap(faiss.IndexFlatL2(dim))
+    elif index_type == "hnsw":
+        hnsw = faiss.IndexHNSWFlat(dim, hnsw_m)
+        hnsw.hnsw.efConstruction = ef_construction
+        index = faiss.IndexIDMap(hnsw)
+    else:
+        nlist = nlist or choose_nlist(count)
+        quantizer = faiss.IndexFlatL2(dim)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        else:
+            if dim % pq_m:
+                raise ValueError(f"Embedding dimension {dim} is not divisible by pq_m={pq_m}")
+            index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, 8)
+        sample = vectors
+        if count > MAX_TRAINING_SAMPLE:
+            rng = np.random.default_rng(seed)
+            sample = vectors[rng.choice(count, MAX_TRAINING_SAMPLE, replace=False)]
+        started = time.perf_counter()
+        index.train(sample)
+        logger.info(f"Trained {index_type} (nlist={nlist}) on {len(sample)} vectors in {time.perf_counter() - started:.1f}s")
+    labels = np.arange(count, dtype=np.int64) if labels is None else np.asarray(labels, dtype=np.int64)
+    index.add_with_ids(vectors, labels)
+    return index
+
+
+def _unwrap(index):
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIDMap):
+        return faiss.downcast_index(index.index)
+    return index
+
+
+def has_labels(index):
+    """True if the index stores explicit labels, so removing vectors leaves the others' labels alone.
+
+    Indexes written before labels were introduced are plain flat or HNSW
+    indexes, whose labels are their positions.
+    """
+    index = faiss.downcast_index(index)
+    return isinstance(index, (faiss.IndexIDMap, faiss.IndexIVF))
+
+
+def index_type_of(index):
+    index = _unwrap(index)
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf_flat"
+    return "flat"
+
+
+def set_search_params(index, nprobe=None, ef_search=None):
+    """Apply query-time recall/latency knobs where the index type supports them."""
+    index = _unwrap(index)
+    if nprobe is not None and isinstance(index, faiss.IndexIVF):
+        index.nprobe = nprobe
+    if ef_search is not None and isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = ef_search
+
+
+def read_index(path, mmap=True):
+    """Load an index, memory-mapping what faiss can map.
+
+    IO_FLAG_MMAP_IFC maps the codes of every index type (flat codes, HNSW
+    storage and IVF inverted lists) straight from the file, so they are paged
+    in on demand instead of read into RAM; the file must not change while the
+    index is in use. faiss builds without it fall back to IO_FLAG_MMAP, which
+    only maps IVF inverted lists. The two flags cannot be combined.
+    """
+    if mmap:
+        flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+        try:
+            return faiss.read_index(path, flag | faiss.IO_FLAG_READ_ONLY)
+        except RuntimeError as e:
+            logger.info(f"Memory-mapped load not supported for {path}, reading fully: {e}")
+    return faiss.read_index(path)
+
+
+def reconstruct_all(index):
+    """Return all stored vectors in position order (approximate for PQ-compressed indexes).
+
+    Only meant for indexes without labels (see has_labels), whose positions
+    are their labels.
+    """
+    # downcast_index does not own the index, so keep the caller's reference alive
+    concrete = faiss.downcast_index(index)
+    if isinstance(concrete, faiss.IndexIVF):
+        concrete.make_direct_map()
+        vectors = concrete.reconstruct_n(0, concrete.ntotal)
+        # An array direct map blocks remove_ids, so drop it again
+        concrete.set_direct_map_type(faiss.DirectMap.NoMap)
+        return vectors
+    return concrete.reconstruct_n(0, concrete.ntotal)
+
+
+def remove_ids(index, labels):
+    """Remove the vectors with labels in place, keeping every other label.
+
+    Returns False, removing nothing, for HNSW, which cannot delete from its
+    graph; such an index has to be rebuilt from the vectors it keeps.
+    """
+    if index_type_of(index) == "hnsw":
+        return False
+    index.remove_ids(np.asarray(labels, dtype=np.int64))
+    return True
+
+
+def recall_report(vectors, queries, index_types=INDEX_TYPES, k=10, nprobe=(1, 8, 32), ef_search=(16, 64, 256)):
+    """Measure recall@k and per-query latency of each index type against exact flat search."""
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    baseline = faiss.IndexFlatL2(vectors.shape[1])
+    baseline.add(vectors)
+    started = time.perf_counter()
+    _, truth = baseline.search(queries, k)
+    rows = [{"type": "flat", "param": "", "recall": 1.0,
+             "ms_per_query": (time.perf_counter() - started) * 1000 / len(queries),
+             "bytes_per_vector": vectors.shape[1] * 4}]
+
+    for index_type in index_types:
+        if index_type == "flat" or not can_build(index_type, len(vectors)):
+            continue
+        index = build_index(vectors, index_type)
+        if index_type == "hnsw":
+            settings = [("efSearch", value, dict(ef_search=value)) for value in ef_search]
+        else:
+            settings = [("nprobe", value, dict(nprobe=value)) for value in nprobe]
+        size = faiss.serialize_index(index).size / len(vectors)
+        for name, value, params in settings:
+            set_search_params(index, **params)
+            started = time.perf_counter()
+            _, found = index.search(queries, k)
+            elapsed = time.perf_counter() - started
+            recall = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+            rows.append({"type": index_type, "param": f"{name}={value}", "recall": float(recall),
+                         "ms_per_query": elapsed * 1000 / len(queries), "bytes_per_vector": size})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs latency of FAISS index types on an existing index.")
+    parser.add_argument("docstore_file", help="path to a published docstore.sqlite3 to take vectors from")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    from .docstore import SQLiteDocstore
+    _, vectors = SQLiteDocstore(args.docstore_file).vectors()
+    rng = np.random.default_rng(0)
+    # Perturbed copies of stored vectors stand in for real query embeddings
+    picks = vectors[rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)]
+    queries = picks + rng.normal(scale=picks.std() * 0.1, size=picks.shape).astype(np.float32)
+    print(f"{'type':<10}{'param':<14}{'recall@' + str(args.k):>10}{'ms/query':>10}{'bytes/vec':>11}")
+    for row in recall_report(vectors, queries, k=args.k):
+        print(f"{row['type']:<10}{row['param']:<14}{row['recall']:>10.3f}{row['ms_per_query']:>10.3f}{row['bytes_per_vector']:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,34 +1,109 @@
-from .RAG import RAG
+from .llm_registry import get_rag
+from .event_loop import get_background_loop
+from .csv_query import CSVQueryEngine
+from langchain.prompts import PromptTemplate
 import asyncio
+import hashlib
 import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+HISTORY_SUMMARY_PROMPT = PromptTemplate(
+    template=(
+        "Update the running summary of a conversation with the turns below. "
+        "Keep facts, names and open questions the user may refer back to; be brief.\n\n"
+        "Current summary:\n{summary}\n\nNew turns:\n{turns}\nUPDATED SUMMARY:"
+    ),
+    input_variables=["summary", "turns"],
+)
+
+def upload_key(uploaded_file):
+    """Identify an upload across Streamlit reruns: its file_id, or a hash of its content."""
+    file_id = getattr(uploaded_file, "file_id", None)
+    if file_id:
+        return file_id
+    return hashlib.sha256(uploaded_file.getvalue()).hexdigest()
+
 
 class Chatbot:
-    def __init__(self, memory, pdf_handler, csv_handler):
+    """Chatbot with an async API and a synchronous facade for app.py.
+
+    The a*-prefixed coroutines do the work; the plain methods submit them to a
+    long-lived background event loop so model clients, connections and the
+    thread pool are reused across requests and independent steps overlap.
+    """
+
+    def __init__(self, memory, pdf_handler, csv_handler, rag=None, loop=None, csv_engine=None):
         self.memory = memory
         self.pdf_handler = pdf_handler
         self.csv_handler = csv_handler
-        self.rag = RAG()  # Initialize the RAG class
+        # Holds uploaded CSVs as queryable tables; pass the same engine across reruns to keep them
+        self.csv_engine = csv_engine or CSVQueryEngine()
+        # The RAG pipeline (embeddings, index, model clients) is shared process-wide
+        self.rag = rag or get_rag()
+        self.loop = loop or get_background_loop()
 
     def process_input(self, user_input):
-        # Add user message to memory (bot response will be added after generation)
-        self.memory.add_message(user_input, None)
-        response = self.generate_response(user_input)
-        # Update last memory entry with bot response
-        self.memory.conversation_history[-1]['bot'] = response
+        return self.loop.run(self.aprocess_input(user_input))
+
+    async def aprocess_input(self, user_input):
+        response = await self.agenerate_response(user_input)
+        # Record the turn once the answer exists so the question is not part of its own history
+        self.remember(user_input, response)
         return response
 
+    def stream_response(self, user_input):
+        """Like get_response, but yields the answer in pieces as it is generated."""
+        yield from self.loop.iterate(self.astream_response(user_input))
+
+    async def astream_response(self, user_input):
+        if not self.is_question(user_input):
+            yield await self.aprocess_input(user_input)
+            return
+        answer = await self.aanswer_from_csv(user_input)
+        if answer is not None:
+            self.remember(user_input, answer)
+            yield answer
+            return
+        parts = []
+        async for chunk in self.rag.stream_user_input(user_input, self.get_history_string()):
+            parts.append(chunk)
+            yield chunk
+        self.remember(user_input, "".join(parts))
+
     def get_history_string(self):
-        history = self.memory.get_history()
-        history_str = ""
-        for turn in history:
-            history_str += f"User: {turn['user']}\n"
-            if turn['bot']:
-                history_str += f"Bot: {turn['bot']}\n"
-        return history_str
+        # Rendered incrementally by Memory and bounded by its token budget
+        return self.memory.get_history_string()
+
+    def remember(self, user_input, response):
+        self.memory.add_message(user_input, response)
+        task = self.memory.summary_task
+        if self.memory.pending_turns() and (task is None or task.done()):
+            # Fold old turns into the rolling summary off the request path. The task lives on
+            # the Memory, which outlives this Chatbot (the app builds one per rerun).
+            self.memory.summary_task = asyncio.ensure_future(self.arefresh_history_summary())
+
+    async def arefresh_history_summary(self):
+        try:
+            while True:
+                pending = self.memory.pending_turns()
+                if not pending:
+                    return
+                summary = await self.rag.run_prompt(
+                    HISTORY_SUMMARY_PROMPT, task="summary", summary=self.memory.summary or "(none)", turns="".join(pending)
+                )
+                if not self.memory.fold_summary(summary, len(pending)):
+                    return
+        except Exception as e:
+            logger.warning(f"Could not update the conversation summary: {e}")
 
     def generate_response(self, user_input):
+        return self.loop.run(self.agenerate_response(user_input))
+
+    async def agenerate_response(self, user_input):
         if self.is_question(user_input):
-            return self.answer_question(user_input)
+            return await self.aanswer_question(user_input)
         elif self.is_summarization_request(user_input):
             return self.summarize_content(user_input)
         else:
@@ -43,9 +118,24 @@ class Chatbot:
         return "summarize" in user_input.lower()
 
     def answer_question(self, question):
+        return self.loop.run(self.aanswer_question(question))
+
+    async def aanswer_question(self, question):
+        answer = await self.aanswer_from_csv(question)
+        if answer is not None:
+            return answer
         history_str = self.get_history_string()
-        response = asyncio.run(self.rag.user_input(question, history_str))
-        return response
+        return await self.rag.user_input(question, history_str)
+
+    async def aanswer_from_csv(self, question):
+        """Answer aggregation questions from the last uploaded CSV table; None means use RAG."""
+        if not self.csv_engine.has_table():
+            return None
+        try:
+            return await self.csv_engine.answer(question, self.rag)
+        except Exception as e:
+            logger.warning(f"CSV query failed, falling back to retrieval: {e}")
+            return None
 
     def summarize_content(self, request):
         # Implement logic to summarize content based on the request
@@ -58,17 +148,39 @@ class Chatbot:
         return self.process_input(user_input)
 
     def process_document(self, uploaded_file):
+        return self.loop.run(self.aprocess_document(uploaded_file))
+
+    async def aprocess_document(self, uploaded_file):
+        if uploaded_file.type != "text/csv":
+            # Questions now concern this document, not a previously uploaded table
+            self.csv_engine.deactivate()
         if uploaded_file.type == "application/pdf":
-            text = self.pdf_handler["extract_text_from_pdf"](uploaded_file)
-            chunks = self.rag.get_text_chunks(text)
-            self.rag.get_vector_store(chunks)  # Create the FAISS index
-            summary = asyncio.run(self.pdf_handler["summarize_pdf"](text, self.rag))
+            # Pages are extracted in parallel and chunked as they arrive
+            pages = self.pdf_handler["iter_pdf_pages"](uploaded_file)
+            text, chunks, metadatas = await asyncio.to_thread(self.rag.chunk_pages, pages)
+            # Index and summarize concurrently; indexing errors still propagate
+            _, summary = await asyncio.gather(
+                self.rag.aget_vector_store(chunks, uploaded_file.name, metadatas),
+                self.pdf_handler["summarize_pdf"](text, self.rag),
+            )
             return summary
         elif uploaded_file.type == "text/csv":
-            data = self.csv_handler["read_csv"](uploaded_file)
-            chunks = self.rag.get_text_chunks(data.to_string())
-            self.rag.get_vector_store(chunks)  # Create the FAISS index
-            summary = asyncio.run(self.csv_handler["summarize_csv"](data, self.rag))
+            key = upload_key(uploaded_file)
+            if self.csv_engine.holds(key):
+                # The app calls this on every rerun while the file stays selected
+                return self.csv_engine.summary
+            # Read in row chunks: header-carrying row groups for the index, statistics for the summary
+            table = self.csv_engine.new_table(key)
+            try:
+                chunks, metadatas, profile = self.csv_handler["ingest_csv"](uploaded_file, table.append)
+                # Indexing streams the file, so the table and profile are complete once it returns
+                await self.rag.aget_vector_store(chunks, uploaded_file.name, metadatas)
+            except BaseException:
+                # Do not keep a partial table as this upload's
+                self.csv_engine.deactivate()
+                raise
+            summary = await self.csv_handler["summarize_csv"](profile, self.rag)
+            self.csv_engine.summary = summary
             return summary
         else:
-            return "Unsupported file format."
\ No newline at end of file
+            return "Unsupported file format."
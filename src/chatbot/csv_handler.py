@@ -1,5 +1,22 @@
 import pandas as pd
 import asyncio # Import asyncio for awaiting
+from collections import Counter
+from itertools import tee
+from langchain.prompts import PromptTemplate
+
+CSV_READ_CHUNKSIZE = 50_000  # rows held in memory at once
+CSV_CHUNK_CHARS = 2000  # target size of each indexed row-group chunk
+TOP_VALUES_TRACKED = 1000  # distinct values counted per text column
+TOP_VALUES_REPORTED = 5
+
+CSV_SUMMARY_PROMPT = PromptTemplate(
+    template=(
+        "The following are statistics computed over every row of a CSV file. "
+        "Describe what the dataset contains and point out notable patterns.\n\n"
+        "{text}\n\nSUMMARY:"
+    ),
+    input_variables=["text"],
+)
 
 def read_csv(file_path):
     """Read a CSV file and return its content as a pandas DataFrame."""
@@ -9,17 +26,114 @@ def read_csv(file_path):
     except Exception as e:
         return str(e)
 
-async def summarize_csv(data: pd.DataFrame, rag_model):
-    """Generate a natural language summary of a pandas DataFrame using the LLM."""
+def iter_csv_frames(file_path, chunksize=CSV_READ_CHUNKSIZE):
+    """Yield the CSV as DataFrames of at most chunksize rows."""
+    if hasattr(file_path, "seek"):
+        file_path.seek(0)
+    yield from pd.read_csv(file_path, chunksize=chunksize)
+
+
+class CSVProfile:
+    """Per-column statistics accumulated one DataFrame chunk at a time."""
+
+    def __init__(self):
+        self.rows = 0
+        self.columns = []
+        self.non_null = Counter()
+        self.numeric_count = Counter()
+        self.sum = Counter()
+        self.sum_sq = Counter()
+        self.min = {}
+        self.max = {}
+        self.top_values = {}
+
+    def update(self, frame):
+        self.rows += len(frame)
+        for column in frame.columns:
+            if column not in self.columns:
+                self.columns.append(column)
+        self.non_null.update(frame.count().to_dict())
+
+        numeric = frame.select_dtypes("number").astype(float)
+        if not numeric.empty:
+            self.numeric_count.update(numeric.count().to_dict())
+            self.sum.update(numeric.sum().to_dict())
+            self.sum_sq.update((numeric ** 2).sum().to_dict())
+            for column, value in numeric.min().items():
+                if pd.notna(value):
+                    self.min[column] = min(value, self.min.get(column, value))
+            for column, value in numeric.max().items():
+                if pd.notna(value):
+                    self.max[column] = max(value, self.max.get(column, value))
+
+        for column in frame.columns.difference(numeric.columns):
+            counts = self.top_values.setdefault(column, Counter())
+            counts.update(frame[column].value_counts().to_dict())
+            if len(counts) > TOP_VALUES_TRACKED:
+                self.top_values[column] = Counter(dict(counts.most_common(TOP_VALUES_TRACKED)))
+
+    def to_text(self):
+        lines = [f"Rows: {self.rows}", f"Columns ({len(self.columns)}):"]
+        for column in self.columns:
+            line = f"- {column}: {self.non_null[column]} non-null"
+            count = self.numeric_count[column]
+            if count:
+                mean = self.sum[column] / count
+                variance = max(self.sum_sq[column] / count - mean ** 2, 0.0)
+                line += (
+                    f", numeric, mean {mean:.4g}, std {variance ** 0.5:.4g}, "
+                    f"min {self.min.get(column)}, max {self.max.get(column)}"
+                )
+            if self.top_values.get(column):
+                top = ", ".join(f"{value} ({n})" for value, n in self.top_values[column].most_common(TOP_VALUES_REPORTED))
+                line += f", top values: {top}"
+            lines.append(line)
+        return "\n".join(lines)
+
+
+def iter_row_chunks(frame, first_row, chunk_chars=CSV_CHUNK_CHARS):
+    """Yield (text, metadata) row-group chunks of frame, each starting with the header line."""
+    if frame.empty:
+        return
+    # Size row groups from the average rendered row length of this frame
+    sample = frame.head(100).to_csv(index=False, header=False)
+    average = max(len(sample) / min(len(frame), 100), 1)
+    rows_per_chunk = max(int(chunk_chars // average), 1)
+    for start in range(0, len(frame), rows_per_chunk):
+        block = frame.iloc[start:start + rows_per_chunk]
+        first = first_row + start
+        yield block.to_csv(index=False), {"rows": f"{first}-{first + len(block) - 1}"}
+
+
+def ingest_csv(file_path, on_frame=None):
+    """Read a CSV in bounded-memory chunks and prepare it for indexing.
+
+    Returns (chunks, metadatas, profile): iterators over header-carrying
+    row-group chunks and the row range each covers, and a CSVProfile of the
+    whole file. The file is read lazily as chunks are consumed, so consume
+    chunks and metadatas in lockstep; the profile is complete once they are
+    exhausted. on_frame, if given, is called with every DataFrame chunk as it
+    is read.
+    """
+    profile = CSVProfile()
+
+    def rows():
+        for frame in iter_csv_frames(file_path):
+            first_row = profile.rows + 1
+            profile.update(frame)
+            if on_frame is not None:
+                on_frame(frame)
+            yield from iter_row_chunks(frame, first_row)
+
+    chunk_rows, metadata_rows = tee(rows())
+    return (text for text, _ in chunk_rows), (metadata for _, metadata in metadata_rows), profile
+
+async def summarize_csv(profile: CSVProfile, rag_model):
+    """Generate a natural language summary of a CSV from its column statistics using the LLM."""
     try:
-        # Convert DataFrame to a string format for summarization
-        # Include column names and some sample data or the whole data as a string
-        # For potentially large CSVs, summarizing the head or a representation might be better
-        # For simplicity, let's convert the whole dataframe to string for now, similar to RAG chunking
-        text_data = data.to_string()
-        
-        # Use the RAG model's summarize method
-        summary = await rag_model.summarize(text_data)
+        # Statistics stay small regardless of row count, unlike rendering the raw rows; the
+        # summarizer caches by content hash, so re-uploading the same data makes no model call
+        summary = await rag_model.summarizer.run(CSV_SUMMARY_PROMPT, profile.to_text())
         return summary
     except Exception as e:
         # Log the error and return an informative message
@@ -31,8 +145,8 @@ def process_csv(file_path):
     data = read_csv(file_path)
     if isinstance(data, str):
         return {"error": data}
-    
+
     # The summarization is now async and happens in chatbot.py's process_document
     # This function might become redundant or need refactoring depending on overall flow.
     # For now, we'll keep it but the primary summarization call is elsewhere.
-    return "CSV processed for summarization."
\ No newline at end of file
+    return "CSV processed for summarization."
@@ -0,0 +1,229 @@
+import re
+import json
+import asyncio
+import sqlite3
+import threading
+import logging
+import pandas as pd
+from langchain.prompts import PromptTemplate
+
+logger = logging.getLogger(__name__)
+
+TABLE_NAME = "data"
+MAX_RESULT_ROWS = 50
+AGGREGATES = {"count": "COUNT", "sum": "SUM", "avg": "AVG", "min": "MIN", "max": "MAX", "count_distinct": "COUNT"}
+FILTER_OPS = {"=", "!=", "<", "<=", ">", ">=", "contains"}
+AGGREGATE_WORDS = re.compile(
+    r"\b(average|avg|mean|total|sum|count|how many|number of|max|maximum|min|minimum|highest|lowest)\b",
+    re.IGNORECASE,
+)
+
+PLAN_PROMPT = PromptTemplate(
+    template=(
+        "You translate questions about a table into a JSON aggregation plan.\n"
+        "Table columns (name: type, sample values):\n{schema}\n\n"
+        "Return only JSON of the form:\n"
+        '{{"applicable": true, "select": [{{"op": "avg", "column": "price"}}], '
+        '"group_by": ["region"], "filters": [{{"column": "year", "op": ">=", "value": 2020}}], '
+        '"order_by": {{"column": "avg_price", "direction": "desc"}}, "limit": 10}}\n'
+        "Allowed ops in select: {aggregates}, or \"value\" for a grouped column. "
+        "Output columns are named <op>_<column> (count of all rows is \"count_all\" with column \"*\"). "
+        "Allowed filter ops: {filter_ops}. "
+        'If the question cannot be answered by aggregating this table, return {{"applicable": false}}.\n\n'
+        "Question: {question}\nJSON:"
+    ),
+    input_variables=["schema", "aggregates", "filter_ops", "question"],
+)
+ANSWER_PROMPT = PromptTemplate(
+    template=(
+        "Answer the question using only this query result computed from the uploaded table.\n"
+        "Question: {question}\nResult (CSV):\n{result}\nANSWER:"
+    ),
+    input_variables=["question", "result"],
+)
+
+
+class PlanError(ValueError):
+    """Raised when the model's plan references unknown columns or disallowed operations."""
+
+
+def _quote(identifier):
+    return '"' + str(identifier).replace('"', '""') + '"'
+
+
+class CSVTable:
+    """One uploaded CSV held in an in-memory SQLite table, loaded chunk by chunk."""
+
+    def __init__(self):
+        self._conn = sqlite3.connect(":memory:", check_same_thread=False)
+        self._lock = threading.Lock()
+        self.columns = {}
+        self.samples = None
+        self.column_pattern = None
+
+    def append(self, frame):
+        with self._lock:
+            if self.samples is None:
+                self.columns = {str(c): str(t) for c, t in frame.dtypes.items()}
+                self.samples = frame.head(3)
+                self.column_pattern = self._mention_pattern(self.columns)
+            frame.to_sql(TABLE_NAME, self._conn, if_exists="append", index=False)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _mention_pattern(columns):
+        # Whole-word matches only, so a column named "id" is not found in "did"
+        names = {name for column in columns for name in (column.lower(), column.lower().replace("_", " ")) if name}
+        alternatives = "|".join(re.escape(name) for name in sorted(names, key=len, reverse=True))
+        return re.compile(rf"(?<!\w)(?:{alternatives})(?!\w)") if alternatives else None
+
+    def mentions_column(self, question):
+        return self.column_pattern is not None and bool(self.column_pattern.search(question.lower()))
+
+    def schema(self):
+        lines = []
+        for column, dtype in self.columns.items():
+            samples = ", ".join(str(v) for v in self.samples[column].tolist())
+            lines.append(f"- {column}: {dtype} ({samples})")
+        return "\n".join(lines)
+
+    def build_query(self, plan):
+        """Turn a validated plan into a parameterized SQL query."""
+        select, names, params = [], [], []
+        group_by = plan.get("group_by") or []
+        for column in group_by:
+            self._check_column(column)
+        for item in plan.get("select") or []:
+            op, column = item.get("op"), item.get("column")
+            if op == "value":
+                if column not in group_by:
+                    raise PlanError(f"Column {column!r} must be grouped to be selected")
+                select.append(_quote(column))
+                names.append(column)
+                continue
+            if op not in AGGREGATES:
+                raise PlanError(f"Unsupported aggregate {op!r}")
+            if column == "*" and op == "count":
+                expression, name = "COUNT(*)", "count_all"
+            else:
+                self._check_column(column)
+                inner = f"DISTINCT {_quote(column)}" if op == "count_distinct" else _quote(column)
+                expression, name = f"{AGGREGATES[op]}({inner})", f"{op}_{column}"
+            select.append(f"{expression} AS {_quote(name)}")
+            names.append(name)
+        for column in group_by:
+            if column not in names:
+                select.insert(0, _quote(column))
+                names.insert(0, column)
+        if not select:
+            raise PlanError("Plan selects nothing")
+
+        sql = f"SELECT {', '.join(select)} FROM {TABLE_NAME}"
+        conditions = []
+        for condition in plan.get("filters") or []:
+            column, op, value = condition.get("column"), condition.get("op"), condition.get("value")
+            self._check_column(column)
+            if op not in FILTER_OPS:
+                raise PlanError(f"Unsupported filter {op!r}")
+            if op == "contains":
+                conditions.append(f"{_quote(column)} LIKE ?")
+                params.append(f"%{value}%")
+            else:
+                conditions.append(f"{_quote(column)} {op} ?")
+                params.append(value)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        if group_by:
+            sql += " GROUP BY " + ", ".join(_quote(c) for c in group_by)
+        order_by = plan.get("order_by")
+        if order_by:
+            if order_by.get("column") not in names:
+                raise PlanError(f"Cannot order by {order_by.get('column')!r}")
+            direction = "DESC" if str(order_by.get("direction", "asc")).lower() == "desc" else "ASC"
+            sql += f" ORDER BY {_quote(order_by['column'])} {direction}"
+        # SQLite reads a negative LIMIT as "no limit", so clamp from below too
+        limit = max(1, min(int(plan.get("limit") or MAX_RESULT_ROWS), MAX_RESULT_ROWS))
+        sql += f" LIMIT {limit}"
+        return sql, params
+
+    def _check_column(self, column):
+        if column not in self.columns:
+            raise PlanError(f"Unknown column {column!r}")
+
+    def execute(self, plan):
+        sql, params = self.build_query(plan)
+        logger.info(f"Running CSV plan: {sql} {params}")
+        with self._lock:
+            return pd.read_sql_query(sql, self._conn, params=params)
+
+
+class CSVQueryEngine:
+    """Answers aggregation questions about uploaded CSVs without vector search.
+
+    The model only writes a small JSON plan over the table schema; the plan is
+    validated against a fixed set of operations, executed locally in SQLite, and
+    just the result rows are sent back to the model to phrase the answer.
+
+    Only the last uploaded CSV is queried, so only its table is kept. key
+    identifies the upload it was loaded from and summary is the summary
+    produced for it, so a rerun with the same file selected reuses both.
+    """
+
+    def __init__(self):
+        self.table = None
+        self.key = None
+        self.summary = None
+
+    def new_table(self, key):
+        """Replace the current table with an empty one for the upload identified by key."""
+        self.deactivate()
+        self.table = CSVTable()
+        self.key = key
+        return self.table
+
+    def holds(self, key):
+        """True if the upload identified by key is loaded and summarized."""
+        return self.table is not None and self.key == key and self.summary is not None
+
+    def has_table(self):
+        return self.table is not None
+
+    def deactivate(self):
+        """Drop the table, e.g. once a non-CSV document was uploaded."""
+        if self.table is not None:
+            self.table.close()
+        self.table = self.key = self.summary = None
+
+    def looks_answerable(self, table, question):
+        """Cheap pre-check so unrelated questions skip the planning call."""
+        return table.mentions_column(question) or bool(AGGREGATE_WORDS.search(question))
+
+    async def answer(self, question, rag):
+        """Return an answer computed from the current table, or None if the question does not fit one."""
+        table = self.table
+        if table is None or not self.looks_answerable(table, question):
+            return None
+        raw_plan = await rag.run_prompt(
+            PLAN_PROMPT,
+            task="plan",
+            schema=table.schema(),
+            aggregates=", ".join(AGGREGATES),
+            filter_ops=", ".join(sorted(FILTER_OPS)),
+            question=question,
+        )
+        try:
+            plan = json.loads(re.sub(r"^```(?:json)?|```$", "", raw_plan.strip(), flags=re.MULTILINE))
+        except json.JSONDecodeError:
+            logger.warning(f"Could not parse CSV plan: {raw_plan!r}")
+            return None
+        if not isinstance(plan, dict) or not plan.get("applicable"):
+            return None
+        try:
+            result = await asyncio.to_thread(table.execute, plan)
+        except (ValueError, TypeError, AttributeError, sqlite3.Error) as e:
+            logger.warning(f"Rejected CSV plan {plan}: {e}")
+            return None
+        return await rag.run_prompt(ANSWER_PROMPT, task="qa", question=question, result=result.to_csv(index=False))
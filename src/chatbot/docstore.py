@@ -0,0 +1,236 @@
+import os
+import re
+import json
+import shutil
+import sqlite3
+import threading
+from collections.abc import Mapping
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+DOCSTORE_FILE = "docstore.sqlite3"
+SCHEMA_VERSION = 3  # 2 added the chunks_fts full-text index, 3 stable labels and vectors
+
+# chunks_fts indexes chunk texts without a copy (external content) and is kept in sync by
+# triggers, so inserting or deleting a chunk updates the lexical index for that chunk only.
+# tokenchars '_' keeps identifiers such as user_id and column names as one term.
+_SCHEMA = f"""
+CREATE TABLE chunks (
+    seq INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    label INTEGER NOT NULL UNIQUE,
+    text TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    vector BLOB NOT NULL
+);
+CREATE VIRTUAL TABLE chunks_fts USING fts5(
+    text, content='chunks', content_rowid='seq', tokenize="unicode61 tokenchars '_'"
+);
+CREATE TRIGGER chunks_insert AFTER INSERT ON chunks BEGIN
+    INSERT INTO chunks_fts (rowid, text) VALUES (new.seq, new.text);
+END;
+CREATE TRIGGER chunks_delete AFTER DELETE ON chunks BEGIN
+    INSERT INTO chunks_fts (chunks_fts, rowid, text) VALUES ('delete', old.seq, old.text);
+END;
+PRAGMA user_version = {SCHEMA_VERSION};
+"""
+
+_TERM = re.compile(r"\w+")
+
+
+def match_expression(text):
+    """FTS5 query matching any term of free text; None if it has no terms.
+
+    Terms are quoted so words such as AND or NEAR and punctuation in questions
+    are never parsed as query syntax.
+    """
+    terms = dict.fromkeys(_TERM.findall(text.lower()))
+    return " OR ".join(f'"{term}"' for term in terms) or None
+
+
+def read_legacy_docstore(path):
+    """Return (index_to_docstore_id, {id: Document}) from a docstore written before SCHEMA_VERSION 3.
+
+    Those files keyed chunks by FAISS position, which is also their label.
+    """
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute("SELECT position, id, text, metadata FROM chunks ORDER BY position").fetchall()
+    finally:
+        conn.close()
+    docs = {chunk_id: Document(page_content=text, metadata=json.loads(metadata)) for _, chunk_id, text, metadata in rows}
+    return {position: chunk_id for position, chunk_id, _, _ in rows}, docs
+
+
+def schema_version(path):
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _read_vectors(conn, labels=None):
+    rows = conn.execute("SELECT label, vector FROM chunks ORDER BY label").fetchall()
+    if labels is not None:
+        labels = set(labels)
+        rows = [row for row in rows if row[0] in labels]
+    if not rows:
+        return np.empty(0, dtype=np.int64), None
+    return (
+        np.array([label for label, _ in rows], dtype=np.int64),
+        np.vstack([np.frombuffer(vector, dtype=np.float32) for _, vector in rows]),
+    )
+
+
+class DocstoreWriter:
+    """Stages the docstore file of a new generation.
+
+    Each row holds a chunk's FAISS label, id, text, JSON metadata and original
+    float32 vector, so a reader can look a hit up by label without loading
+    anything else and indexes can be rebuilt without quantization loss. The
+    file starts as a copy of the previous generation's (base_path) and chunks
+    are added and removed as an update goes along, so only the chunks that
+    changed are held in memory or re-indexed for full-text search. Nothing is
+    visible at path until commit().
+    """
+
+    def __init__(self, path, base_path=None):
+        self.path = path
+        self._tmp_path = path + f".{os.getpid()}.{threading.get_ident()}.tmp"
+        if base_path is not None:
+            shutil.copyfile(base_path, self._tmp_path)
+        self._conn = sqlite3.connect(self._tmp_path)
+        if base_path is None:
+            self._conn.executescript(_SCHEMA)
+
+    def add(self, labels, ids, texts, metadatas, vectors):
+        self._conn.executemany(
+            "INSERT INTO chunks (label, id, text, metadata, vector) VALUES (?, ?, ?, ?, ?)",
+            (
+                (int(label), chunk_id, text, json.dumps(metadata), np.asarray(vector, dtype=np.float32).tobytes())
+                for label, chunk_id, text, metadata, vector in zip(labels, ids, texts, metadatas, vectors)
+            ),
+        )
+
+    def remove(self, ids):
+        self._conn.executemany("DELETE FROM chunks WHERE id = ?", ((i,) for i in ids))
+
+    def vectors(self, labels=None):
+        """Return (labels, n x d float32 vectors) of every staged chunk, or of labels, in label order."""
+        return _read_vectors(self._conn, labels)
+
+    def commit(self, path=None):
+        """Write the file to path (default self.path), replacing any file there."""
+        self._conn.commit()
+        self._conn.close()
+        os.replace(self._tmp_path, path or self.path)
+
+    def discard(self):
+        self._conn.close()
+        try:
+            os.remove(self._tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+def write_docstore(path, docstore, index_to_docstore_id, vectors):
+    """Write every chunk of index_to_docstore_id, read from docstore and vectors (id -> vector), to path."""
+    writer = DocstoreWriter(path)
+    try:
+        items = sorted(index_to_docstore_id.items())
+        docs = [docstore.search(chunk_id) for _, chunk_id in items]
+        writer.add(
+            [label for label, _ in items], [chunk_id for _, chunk_id in items],
+            [doc.page_content for doc in docs], [doc.metadata for doc in docs],
+            [vectors[chunk_id] for _, chunk_id in items],
+        )
+        writer.commit()
+    except BaseException:
+        writer.discard()
+        raise
+
+
+class SQLiteDocstore(Docstore):
+    """Read-only docstore over a published docstore file, queried per hit.
+
+    Opening it reads nothing; search(id) reads a single row and search_text()
+    ranks chunks with the file's full-text index.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Published files are never modified, so the connection can be shared read-only
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.index_to_docstore_id = _LabelMap(self)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def search(self, search):
+        rows = self._query("SELECT text, metadata FROM chunks WHERE id = ?", (search,))
+        if not rows:
+            return f"ID {search} not found."
+        text, metadata = rows[0]
+        return Document(page_content=text, metadata=json.loads(metadata))
+
+    def search_text(self, query, k=10):
+        """Return up to k (id, score) pairs for free text, best first, scored with BM25."""
+        expression = match_expression(query)
+        if expression is None:
+            return []
+        # bm25() is lower for better matches
+        rows = self._query(
+            "SELECT chunks.id, bm25(chunks_fts) AS score FROM chunks_fts "
+            "JOIN chunks ON chunks.seq = chunks_fts.rowid "
+            "WHERE chunks_fts MATCH ? ORDER BY score LIMIT ?",
+            (expression, k),
+        )
+        return [(chunk_id, -score) for chunk_id, score in rows]
+
+    def delete(self, ids):
+        raise NotImplementedError("Published docstores are read-only")
+
+    def vectors(self, labels=None):
+        """Return (labels, n x d float32 vectors) of every chunk, or of labels, in label order."""
+        with self._lock:
+            return _read_vectors(self._conn, labels)
+
+    def contains(self, ids):
+        """Return the subset of ids that are stored."""
+        ids = list(ids)
+        found = set()
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(ids), 500):
+            batch = ids[start:start + 500]
+            rows = self._query(f"SELECT id FROM chunks WHERE id IN ({', '.join('?' * len(batch))})", batch)
+            found.update(chunk_id for chunk_id, in rows)
+        return found
+
+
+class _LabelMap(Mapping):
+    """FAISS label -> chunk id, read from the docstore on demand."""
+
+    def __init__(self, docstore):
+        self._docstore = docstore
+
+    def __getitem__(self, label):
+        rows = self._docstore._query("SELECT id FROM chunks WHERE label = ?", (int(label),))
+        if not rows:
+            raise KeyError(label)
+        return rows[0][0]
+
+    def __iter__(self):
+        return (label for label, in self._docstore._query("SELECT label FROM chunks ORDER BY label"))
+
+    def __len__(self):
+        return self._docstore._query("SELECT COUNT(*) FROM chunks")[0][0]
+
+    def items(self):
+        return self._docstore._query("SELECT label, id FROM chunks ORDER BY label")
+
+    def values(self):
+        return [chunk_id for chunk_id, in self._docstore._query("SELECT id FROM chunks ORDER BY label")]
@@ -0,0 +1,124 @@
+import sqlite3
+import threading
+import time
+import logging
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from .index_manager import content_hash
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 200_000
+_SQL_BATCH = 500  # Stay well below SQLite's bound-parameter limit
+
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an Embeddings model with a persistent SQLite cache of float32 vectors.
+
+    Entries are keyed by model name, embedding kind (document or query, since
+    the remote model embeds them differently) and the text's hash. The least
+    recently used entries are evicted once the cache grows past max_entries.
+    """
+
+    def __init__(self, embeddings, path, model_name, max_entries=DEFAULT_MAX_ENTRIES):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, kind TEXT NOT NULL, text_hash TEXT NOT NULL, "
+            "vector BLOB NOT NULL, last_used REAL NOT NULL, "
+            "PRIMARY KEY (model, kind, text_hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": self._size,
+        }
+
+    def _lookup(self, kind, hashes):
+        found = {}
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(hashes), _SQL_BATCH):
+                batch = hashes[i:i + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings "
+                    f"WHERE model = ? AND kind = ? AND text_hash IN ({placeholders})",
+                    [self.model_name, kind, *batch],
+                ).fetchall()
+                for text_hash, blob in rows:
+                    found[text_hash] = np.frombuffer(blob, dtype=np.float32).tolist()
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE model = ? AND kind = ? AND text_hash = ?",
+                    [(now, self.model_name, kind, h) for h in found],
+                )
+                self._conn.commit()
+        return found
+
+    def _store(self, kind, items):
+        now = time.time()
+        rows = [
+            (self.model_name, kind, h, np.asarray(v, dtype=np.float32).tobytes(), now)
+            for h, v in items
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, kind, text_hash, vector, last_used) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._size += len(rows)
+            if self._size > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Trim to 90% of the cap so eviction does not run on every insert
+        target = int(self.max_entries * 0.9)
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self._size - target
+        if excess > 0:
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+            self._size -= excess
+            logger.info(f"Evicted {excess} cached embeddings")
+
+    def _embed(self, kind, texts, compute):
+        hashes = [content_hash(text) for text in texts]
+        found = self._lookup(kind, list(dict.fromkeys(hashes)))
+        missing = {}
+        for h, text in zip(hashes, texts):
+            if h not in found:
+                missing.setdefault(h, text)
+        self.hits += len(texts) - sum(1 for h in hashes if h in missing)
+        self.misses += len(missing)
+        if missing:
+            vectors = compute(list(missing.values()))
+            computed = list(zip(missing.keys(), vectors))
+            self._store(kind, computed)
+            found.update(computed)
+        return [found[h] for h in hashes]
+
+    def embed_documents(self, texts):
+        return self._embed("document", texts, self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        return self._embed("query", [text], lambda texts: [self.embeddings.embed_query(texts[0])])[0]
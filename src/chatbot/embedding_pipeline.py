@@ -0,0 +1,86 @@
+import asyncio
+import random
+import time
+import logging
+import google.api_core.exceptions
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERRORS = (
+    google.api_core.exceptions.ResourceExhausted,
+    google.api_core.exceptions.ServiceUnavailable,
+    google.api_core.exceptions.DeadlineExceeded,
+)
+
+
+class TokenBucket:
+    """Async token bucket allowing `rate` acquisitions per second with bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, tokens=1):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+
+
+async def embed_texts(
+    embeddings,
+    texts,
+    batch_size=16,
+    max_in_flight=4,
+    requests_per_minute=120,
+    max_retries=6,
+    base_delay=1.0,
+    max_delay=60.0,
+    executor=None,
+):
+    """Embed texts in concurrent batches and return the vectors in input order.
+
+    At most max_in_flight batches are outstanding, batches start no faster than
+    requests_per_minute allows (None for local models with no quota), and a
+    throttled batch is retried on its own with exponential backoff and full
+    jitter instead of stalling the others. executor runs the blocking
+    embed_documents calls (None uses the loop's default thread pool).
+    """
+    bucket = TokenBucket(requests_per_minute / 60.0, capacity=max_in_flight) if requests_per_minute else None
+    semaphore = asyncio.Semaphore(max_in_flight)
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+
+    async def embed_batch(batch):
+        for attempt in range(max_retries):
+            if bucket is not None:
+                await bucket.acquire()
+            async with semaphore:
+                try:
+                    return await loop.run_in_executor(executor, embeddings.embed_documents, batch)
+                except RETRYABLE_ERRORS as e:
+                    if attempt == max_retries - 1:
+                        raise
+                    delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+                    logger.warning(f"Embedding batch throttled ({e.__class__.__name__}), retrying in {delay:.1f}s")
+            # Back off outside the semaphore so other batches can use the slot
+            await asyncio.sleep(delay)
+
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    results = await asyncio.gather(*(embed_batch(batch) for batch in batches))
+    vectors = [vector for batch in results for vector in batch]
+
+    elapsed = time.perf_counter() - started
+    logger.info(
+        f"Embedded {len(texts)} chunks in {elapsed:.1f}s "
+        f"({len(texts) / elapsed if elapsed else 0.0:.1f} chunks/s)"
+    )
+    return vectors
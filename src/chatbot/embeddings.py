@@ -0,0 +1,118 @@
+import time
+import asyncio
+import logging
+import argparse
+import threading
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BACKENDS = ("google", "local")
+DEFAULT_GOOGLE_MODEL = "models/embedding-001"
+DEFAULT_LOCAL_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+class LocalEmbeddings(Embeddings):
+    """Sentence-transformers model running batched on CPU; works offline once downloaded.
+
+    threads caps torch's intra-op thread pool (None keeps torch's default).
+    With onnx the model runs on onnxruntime, optionally from a quantized
+    onnx_file; otherwise quantize applies dynamic int8 quantization to the
+    torch model's linear layers. The model is loaded on first use.
+    """
+
+    def __init__(self, model_name=DEFAULT_LOCAL_MODEL, batch_size=64, threads=None,
+                 onnx=False, onnx_file=None, quantize=False, query_prefix="", document_prefix=""):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.threads = threads
+        self.onnx = onnx
+        self.onnx_file = onnx_file
+        self.quantize = quantize
+        self.query_prefix = query_prefix
+        self.document_prefix = document_prefix
+        self._model = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._model is None:
+                import torch
+                from sentence_transformers import SentenceTransformer
+                started = time.perf_counter()
+                if self.threads:
+                    torch.set_num_threads(self.threads)
+                if self.onnx:
+                    model_kwargs = {"file_name": self.onnx_file} if self.onnx_file else {}
+                    model = SentenceTransformer(self.model_name, device="cpu", backend="onnx", model_kwargs=model_kwargs)
+                else:
+                    model = SentenceTransformer(self.model_name, device="cpu")
+                    if self.quantize:
+                        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+                self._model = model
+                logger.info(f"Loaded embedding model {self.model_name} in {time.perf_counter() - started:.1f}s")
+        return self._model
+
+    def _encode(self, texts):
+        vectors = self._load().encode(
+            texts, batch_size=self.batch_size, convert_to_numpy=True, normalize_embeddings=True
+        )
+        return vectors.tolist()
+
+    def embed_documents(self, texts):
+        return self._encode([self.document_prefix + text for text in texts])
+
+    def embed_query(self, text):
+        return self._encode([self.query_prefix + text])[0]
+
+
+def embedding_id(backend, model):
+    """Identifier recorded with an index and used to key cached vectors."""
+    return model if backend == "google" else f"{backend}:{model}"
+
+
+def make_embeddings(backend="google", model=None, **options):
+    """Create the Embeddings for backend ("google" or "local"); options go to LocalEmbeddings."""
+    if backend == "google":
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        return GoogleGenerativeAIEmbeddings(model=model or DEFAULT_GOOGLE_MODEL)
+    if backend == "local":
+        return LocalEmbeddings(model or DEFAULT_LOCAL_MODEL, **options)
+    raise ValueError(f"Unknown embedding backend {backend!r}; expected one of {EMBEDDING_BACKENDS}")
+
+
+def main():
+    from dotenv import load_dotenv
+    from .embedding_pipeline import embed_texts
+
+    parser = argparse.ArgumentParser(description="Compare embedding throughput (chunks/s) of the backends.")
+    parser.add_argument("--backends", nargs="+", default=list(EMBEDDING_BACKENDS), choices=EMBEDDING_BACKENDS)
+    parser.add_argument("--chunks", type=int, default=256)
+    parser.add_argument("--chunk-chars", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--onnx", action="store_true")
+    parser.add_argument("--quantize", action="store_true")
+    args = parser.parse_args()
+    load_dotenv()
+
+    words = "retrieval augmented generation answers questions from uploaded documents".split()
+    texts = [
+        " ".join(words[(i + j) % len(words)] for j in range(args.chunk_chars // 8))[:args.chunk_chars]
+        for i in range(args.chunks)
+    ]
+    for backend in args.backends:
+        if backend == "local":
+            embeddings = make_embeddings("local", threads=args.threads, onnx=args.onnx, quantize=args.quantize)
+            embeddings.embed_query("warm up")  # exclude model loading from the timing
+            settings = dict(batch_size=embeddings.batch_size, max_in_flight=1, requests_per_minute=None)
+        else:
+            embeddings = make_embeddings("google")
+            settings = {}
+        started = time.perf_counter()
+        asyncio.run(embed_texts(embeddings, texts, **settings))
+        elapsed = time.perf_counter() - started
+        print(f"{backend:<8}{len(texts) / elapsed:>10.1f} chunks/s  ({elapsed:.1f}s for {len(texts)} chunks)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import asyncio
+import threading
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+class BackgroundLoop:
+    """An asyncio event loop running forever on a daemon thread.
+
+    Synchronous callers (Streamlit, CLI) submit coroutines with run() or drain
+    async generators with iterate(); the loop, its default thread pool and any
+    async clients bound to it live for the whole process.
+    """
+
+    def __init__(self, name="chatbot-event-loop"):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, coro):
+        """Schedule coro on the loop and return a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        """Run coro on the loop and block until it finishes."""
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("BackgroundLoop.run() called from its own loop; await the coroutine instead")
+        return self.submit(coro).result(timeout)
+
+    def iterate(self, agen):
+        """Drive an async generator from synchronous code, one item at a time."""
+        async def next_item():
+            return await agen.__anext__()
+
+        async def close():
+            await agen.aclose()
+
+        try:
+            while True:
+                try:
+                    yield self.run(next_item())
+                except StopAsyncIteration:
+                    return
+        finally:
+            self.run(close())
+
+
+def get_background_loop():
+    """Return the process-wide BackgroundLoop, starting it on first use."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = BackgroundLoop()
+        return _shared
@@ -0,0 +1,389 @@
+import os
+import json
+import pickle
+import hashlib
+import shutil
+import threading
+import logging
+from itertools import islice, repeat
+import numpy as np
+import faiss
+from langchain_community.vectorstores import FAISS
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from .docstore import (
+    DOCSTORE_FILE, SCHEMA_VERSION, DocstoreWriter, SQLiteDocstore, read_legacy_docstore, schema_version,
+    write_docstore,
+)
+from .ann import (
+    build_index, can_build, has_labels, index_type_of, read_index, reconstruct_all, remove_ids, set_search_params,
+)
+
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+INDEX_FILE = "index.faiss"
+LEGACY_DOCSTORE_FILE = "index.pkl"
+KEEP_VERSIONS = 2  # Older versions stay on disk briefly for readers in other processes
+RETRAIN_GROWTH = 4  # retrain IVF centroids once the corpus is this many times the training set
+INGEST_BATCH_SIZE = 256  # chunks hashed, embedded and staged at a time by update_document
+
+
+def content_hash(text):
+    """Stable id for a chunk, so identical text is only ever embedded and stored once."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _matrix(vectors, dim):
+    # A store with no chunks left still needs a 0 x dim matrix to build an index from
+    return vectors if vectors is not None else np.empty((0, dim), dtype=np.float32)
+
+
+class IndexManager:
+    """Keeps one FAISS index resident in memory for the whole process.
+
+    Every published index lives in its own versioned subdirectory and the
+    CURRENT file holds the generation readers should use. A new version is
+    fully written before CURRENT is atomically replaced, so readers only ever
+    load complete indexes and keep using the old copy until the swap.
+
+    index_type selects the ANN structure ("flat", "ivf_flat", "ivf_pq" or
+    "hnsw", see chatbot.ann); small corpora stay flat until there is enough
+    data to train the configured type. search_params (nprobe, ef_search) are
+    applied on every load. With mmap, served indexes are memory-mapped from
+    their published files, which are never modified (see
+    chatbot.ann.read_index).
+    embedding_id names the embedding model; it is recorded in the manifest and
+    an index built with a different model is refused.
+    """
+
+    def __init__(self, path, embeddings, index_type="flat", index_params=None, search_params=None, mmap=True,
+                 embedding_id=None):
+        self.path = path
+        self.embeddings = embeddings
+        self.embedding_id = embedding_id
+        self.index_type = index_type
+        self.index_params = index_params or {}
+        self.search_params = search_params or {}
+        self.mmap = mmap
+        self._lock = threading.Lock()
+        self._publish_lock = threading.RLock()
+        self._store = None
+        self._generation = None
+        os.makedirs(self.path, exist_ok=True)
+
+    def _current_path(self):
+        return os.path.join(self.path, CURRENT_FILE)
+
+    def _version_dir(self, generation):
+        # Generation 0 is the legacy layout written directly into the index directory
+        if generation == 0:
+            return self.path
+        return os.path.join(self.path, f"v{generation:06d}")
+
+    def read_generation(self):
+        """Return the generation published on disk, or None if there is no index yet."""
+        try:
+            with open(self._current_path()) as f:
+                return int(f.read().strip())
+        except FileNotFoundError:
+            if os.path.exists(os.path.join(self.path, INDEX_FILE)):
+                return 0
+            return None
+
+    @property
+    def generation(self):
+        """Generation of the index currently served from memory."""
+        return self._generation
+
+    def exists(self):
+        return self.read_generation() is not None
+
+    def get(self):
+        """Return the in-memory vector store, loading it only when a newer version was published.
+
+        Its docstore is a SQLiteDocstore, whose search_text() is the lexical
+        index of the same generation.
+        """
+        generation = self.read_generation()
+        if generation is None:
+            raise FileNotFoundError("FAISS index not found. Please upload documents to create the index.")
+        with self._lock:
+            if self._store is None or generation != self._generation:
+                logger.info(f"Loading FAISS index generation {generation}")
+                self._check_embedding(self._load_manifest(generation))
+                self._store = self._load(generation)
+                self._generation = generation
+            return self._store
+
+    def _load(self, generation, writable=False):
+        """Load a generation without unpickling anything.
+
+        Served copies read chunk texts from SQLite per hit. Writable copies
+        (for update_document) read the index fully and only the chunk ids; their
+        docstore is left empty, as changes are staged in a DocstoreWriter.
+        """
+        directory = self._version_dir(generation)
+        docstore = self._docstore(generation)
+        index = read_index(os.path.join(directory, INDEX_FILE), mmap=self.mmap and not writable)
+        if writable and not has_labels(index):
+            # Written before labels existed; relabel once so deletions stop renumbering vectors
+            labels, vectors = docstore.vectors()
+            index = build_index(_matrix(vectors, index.d), index_type_of(index), labels=labels, **self.index_params)
+        set_search_params(index, **self.search_params)
+        if writable:
+            return FAISS(self.embeddings, index, InMemoryDocstore({}), dict(docstore.index_to_docstore_id.items()))
+        return FAISS(self.embeddings, index, docstore, docstore.index_to_docstore_id)
+
+    def _docstore_path(self, generation):
+        return os.path.join(self._version_dir(generation), DOCSTORE_FILE)
+
+    def _docstore(self, generation):
+        path = self._docstore_path(generation)
+        if not os.path.exists(path) or schema_version(path) < SCHEMA_VERSION:
+            self._migrate(self._version_dir(generation))
+        return SQLiteDocstore(path)
+
+    def _migrate(self, directory):
+        # Docstores from before stable labels (a pickle written by FAISS.save_local, or SQLite
+        # keyed by position) are rewritten once. Their indexes have no labels, so a vector's
+        # position is its label and the vectors can be read back from the index (approximately
+        # for ivf_pq). Only ever done for files this application wrote itself.
+        docstore_path = os.path.join(directory, DOCSTORE_FILE)
+        logger.info(f"Migrating the docstore in {directory} to {DOCSTORE_FILE} schema {SCHEMA_VERSION}")
+        if os.path.exists(docstore_path):
+            index_to_docstore_id, docs = read_legacy_docstore(docstore_path)
+            docstore = InMemoryDocstore(docs)
+        else:
+            with open(os.path.join(directory, LEGACY_DOCSTORE_FILE), "rb") as f:
+                docstore, index_to_docstore_id = pickle.load(f)
+        vectors = reconstruct_all(read_index(os.path.join(directory, INDEX_FILE), mmap=False))
+        write_docstore(
+            docstore_path, docstore, index_to_docstore_id,
+            {chunk_id: vectors[position] for position, chunk_id in index_to_docstore_id.items()},
+        )
+
+    def _open_update(self, generation, dim):
+        """Return (writable store, DocstoreWriter) to apply an update to generation on.
+
+        Without a generation, the store starts as an empty flat index; it is
+        upgraded to the configured type once there is enough data.
+        """
+        if generation is None:
+            index = build_index(np.empty((0, dim), dtype=np.float32), "flat")
+            store = FAISS(self.embeddings, index, InMemoryDocstore({}), {})
+            return store, DocstoreWriter(os.path.join(self.path, DOCSTORE_FILE))
+        store = self._load(generation, writable=True)
+        return store, DocstoreWriter(os.path.join(self.path, DOCSTORE_FILE), self._docstore_path(generation))
+
+    def _add(self, store, writer, ids, texts, metadatas, vectors):
+        # Labels are never reused while their vector is in the index, and never change
+        start = max(store.index_to_docstore_id, default=-1) + 1
+        labels = np.arange(start, start + len(ids), dtype=np.int64)
+        store.index.add_with_ids(np.array(vectors, dtype=np.float32), labels)
+        store.index_to_docstore_id.update(zip(labels.tolist(), ids))
+        writer.add(labels, ids, texts, metadatas, vectors)
+
+    def _delete(self, store, writer, ids):
+        """Remove ids from store; False if the index still has their vectors and must be rebuilt."""
+        ids = set(ids)
+        labels = [label for label, chunk_id in store.index_to_docstore_id.items() if chunk_id in ids]
+        for label in labels:
+            del store.index_to_docstore_id[label]
+        writer.remove(ids)
+        return remove_ids(store.index, labels)
+
+    def _maybe_retrain(self, store, writer, manifest, rebuild=False):
+        """Rebuild the index when it must drop deleted vectors (hnsw), is not yet the configured type
+        or has outgrown its training set.
+
+        The staged docstore holds the original vector of every chunk, so
+        rebuilding never trains on quantized codes; labels are kept, leaving
+        the docstore mapping valid.
+        """
+        count = len(store.index_to_docstore_id)
+        trained_on = manifest.get("index", {}).get("trained_on", count)
+        current = index_type_of(store.index)
+        upgrade = count and current != self.index_type and can_build(self.index_type, count)
+        outgrown = current.startswith("ivf") and count >= RETRAIN_GROWTH * max(trained_on, 1)
+        if upgrade or outgrown or rebuild:
+            index_type = self.index_type if upgrade or outgrown else current
+            logger.info(f"Rebuilding {current} index of {count} vectors as {index_type}")
+            labels, vectors = writer.vectors()
+            store.index = build_index(_matrix(vectors, store.index.d), index_type, labels=labels, **self.index_params)
+            set_search_params(store.index, **self.search_params)
+            if upgrade or outgrown:
+                trained_on = count
+        manifest["index"] = {"type": index_type_of(store.index), "trained_on": trained_on}
+
+    def _load_manifest(self, generation):
+        # The manifest maps each document id to the vector ids (chunk hashes) it owns
+        if generation is None:
+            return {"documents": {}}
+        try:
+            with open(os.path.join(self._version_dir(generation), MANIFEST_FILE)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"documents": {}}
+
+    def _check_embedding(self, manifest):
+        # Manifests written before the embedding was recorded are assumed compatible
+        recorded = manifest.get("embedding")
+        if recorded and self.embedding_id and recorded != self.embedding_id:
+            raise ValueError(
+                f"Index at {self.path} was built with embedding {recorded!r}, not {self.embedding_id!r}. "
+                "Use a separate index directory per embedding backend."
+            )
+
+    def documents(self):
+        """Return the ids of all documents in the published index."""
+        return list(self._load_manifest(self.read_generation())["documents"])
+
+    def update_document(self, document_id, chunks, embed_texts, metadatas=None):
+        """Make document_id own exactly chunks, embedding only chunks not already indexed.
+
+        chunks and metadatas may be any iterables (generators included); they
+        are hashed, embedded and staged INGEST_BATCH_SIZE at a time, so only
+        the document's chunk ids are kept for the whole run. embed_texts(texts)
+        must return one vector per text. Chunks the document no longer owns are
+        deleted unless another document still references them. Returns the
+        generation serving the result.
+        """
+        with self._publish_lock:
+            generation = self.read_generation()
+            manifest = self._load_manifest(generation)
+            self._check_embedding(manifest)
+            if self.embedding_id:
+                manifest["embedding"] = self.embedding_id
+            documents = manifest["documents"]
+            base = self._docstore(generation) if generation is not None else None
+
+            # Work on a private copy, opened once there is something to change; the
+            # in-memory store keeps serving readers meanwhile
+            store = writer = None
+            try:
+                owned = {}
+                embedded = 0
+                pairs = zip(chunks, metadatas if metadatas is not None else repeat({}))
+                for batch in _batches(pairs, INGEST_BATCH_SIZE):
+                    fresh = {}
+                    for chunk, metadata in batch:
+                        chunk_id = content_hash(chunk)
+                        if chunk_id not in owned and chunk_id not in fresh:
+                            fresh[chunk_id] = (chunk, metadata)
+                    owned.update(dict.fromkeys(fresh))
+                    stored = base.contains(fresh) if base is not None else set()
+                    new_ids = [i for i in fresh if i not in stored]
+                    if not new_ids:
+                        continue
+                    texts = [fresh[i][0] for i in new_ids]
+                    vectors = embed_texts(texts)
+                    if store is None:
+                        store, writer = self._open_update(generation, len(vectors[0]))
+                    self._add(store, writer, new_ids, texts, [fresh[i][1] for i in new_ids], vectors)
+                    embedded += len(new_ids)
+
+                previous = set(documents.get(document_id, []))
+                if previous == set(owned) and (owned or document_id not in documents):
+                    logger.info(f"Document {document_id!r} is unchanged, skipping ingestion")
+                    return generation
+                if generation is None and store is None:
+                    return generation
+
+                owned_elsewhere = set()
+                for other_id, ids in documents.items():
+                    if other_id != document_id:
+                        owned_elsewhere.update(ids)
+                removed = previous - set(owned) - owned_elsewhere
+                removed = base.contains(removed) if base is not None else set()
+                if store is None:
+                    store, writer = self._open_update(generation, None)
+                rebuild = bool(removed) and not self._delete(store, writer, removed)
+                self._maybe_retrain(store, writer, manifest, rebuild=rebuild)
+                logger.info(
+                    f"Document {document_id!r}: {embedded} chunks embedded, "
+                    f"{len(owned) - embedded} reused, {len(removed)} removed"
+                )
+
+                if owned:
+                    documents[document_id] = list(owned)
+                else:
+                    documents.pop(document_id, None)
+                return self.publish(store, writer, manifest)
+            except BaseException:
+                if writer is not None:
+                    writer.discard()
+                raise
+
+    def delete_document(self, document_id):
+        """Remove every chunk owned only by document_id from the index."""
+        return self.update_document(document_id, [], embed_texts=None)
+
+    def publish(self, vector_store, docstore_writer, manifest=None):
+        """Persist vector_store as a new generation and swap it in for all readers.
+
+        docstore_writer holds the generation's chunks (see
+        chatbot.docstore.DocstoreWriter) and is committed into the new version.
+        """
+        with self._publish_lock:
+            generation = (self.read_generation() or 0) + 1
+            # Claim a fresh version directory; another process may have taken this generation
+            while True:
+                version_dir = self._version_dir(generation)
+                try:
+                    os.makedirs(version_dir)
+                    break
+                except FileExistsError:
+                    generation += 1
+            self._save(vector_store, docstore_writer, version_dir)
+            with open(os.path.join(version_dir, MANIFEST_FILE), "w") as f:
+                json.dump(manifest or {"documents": {}}, f)
+
+            tmp_path = self._current_path() + f".{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(str(generation))
+            os.replace(tmp_path, self._current_path())
+
+            with self._lock:
+                # Serve the published files rather than the fully loaded copy just written
+                self._store = self._load(generation)
+                self._generation = generation
+            logger.info(f"Published FAISS index generation {generation}")
+            self._prune(generation)
+            return generation
+
+    def _save(self, vector_store, docstore_writer, version_dir):
+        faiss.write_index(vector_store.index, os.path.join(version_dir, INDEX_FILE))
+        docstore_writer.commit(os.path.join(version_dir, DOCSTORE_FILE))
+
+    def _prune(self, generation):
+        for name in os.listdir(self.path):
+            if not name.startswith("v") or not name[1:].isdigit():
+                continue
+            if int(name[1:]) <= generation - KEEP_VERSIONS:
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_index_manager(path, embeddings, **options):
+    """Return the process-wide IndexManager for path, creating it on first use.
+
+    options are passed to IndexManager and only take effect on creation.
+    """
+    key = os.path.abspath(path)
+    with _managers_lock:
+        if key not in _managers:
+            _managers[key] = IndexManager(path, embeddings, **options)
+        return _managers[key]
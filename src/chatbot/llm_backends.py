@@ -0,0 +1,157 @@
+import os
+import asyncio
+import logging
+import httpx
+import ollama
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OLLAMA_MODEL = "llama3.2:3b"
+OLLAMA_KEEP_ALIVE = "30m"  # keep the model resident on the server between requests
+
+
+class BackendUnavailable(RuntimeError):
+    """The backend could not be reached; the router may try the next candidate."""
+
+
+class LLMBackend:
+    """Text-in, text-out access to one chat model."""
+
+    name = "base"
+
+    def __init__(self, model, temperature):
+        self.model = model
+        self.temperature = temperature
+
+    @property
+    def label(self):
+        return f"{self.name}:{self.model}"
+
+    async def complete(self, prompt):
+        raise NotImplementedError
+
+    async def stream(self, prompt):
+        """Yield the response in pieces as it is generated."""
+        yield await self.complete(prompt)
+
+
+class GeminiBackend(LLMBackend):
+    name = "gemini"
+
+    def __init__(self, model, temperature, client=None):
+        super().__init__(model, temperature)
+        self.client = client or ChatGoogleGenerativeAI(model=model, temperature=temperature)
+
+    async def complete(self, prompt):
+        response = await asyncio.to_thread(self.client.invoke, prompt)
+        return response.content
+
+    async def stream(self, prompt):
+        async for chunk in self.client.astream(prompt):
+            if chunk.content:
+                yield chunk.content
+
+
+class OllamaBackend(LLMBackend):
+    """Chat model served by Ollama at OLLAMA_HOST (default http://localhost:11434).
+
+    One AsyncClient is reused for every request, so its HTTP connections are
+    kept alive, and keep_alive keeps the model loaded on the server.
+    """
+
+    name = "ollama"
+
+    def __init__(self, model=DEFAULT_OLLAMA_MODEL, temperature=0.5, host=None, keep_alive=OLLAMA_KEEP_ALIVE):
+        super().__init__(model, temperature)
+        self.host = host or os.getenv("OLLAMA_HOST")
+        self.keep_alive = keep_alive
+        self.client = ollama.AsyncClient(host=self.host)
+
+    def _chat(self, prompt, stream):
+        return self.client.chat(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            options={"temperature": self.temperature},
+            keep_alive=self.keep_alive,
+            stream=stream,
+        )
+
+    def _unavailable(self, error):
+        return BackendUnavailable(f"Ollama at {self.host or 'localhost'} is unreachable: {error}")
+
+    async def complete(self, prompt):
+        try:
+            response = await self._chat(prompt, stream=False)
+        except (ConnectionError, httpx.TransportError) as e:
+            raise self._unavailable(e) from e
+        return response["message"]["content"]
+
+    async def stream(self, prompt):
+        try:
+            # The request is only sent once iteration starts
+            async for part in await self._chat(prompt, stream=True):
+                content = part["message"]["content"]
+                if content:
+                    yield content
+        except (ConnectionError, httpx.TransportError) as e:
+            raise self._unavailable(e) from e
+
+
+def route_matches(route, task, prompt_tokens):
+    if route.get("task") not in (None, task):
+        return False
+    return prompt_tokens <= route.get("max_prompt_tokens", float("inf"))
+
+
+class LLMRouter:
+    """Picks a backend per request from ordered routing rules.
+
+    Each route is a dict with "backend" and "model" plus optional conditions:
+    "task" (e.g. "qa", "summary", "plan") and "max_prompt_tokens". Matching
+    routes are tried in order, falling through to the next one when a backend
+    is unreachable, so a local model can take short or cheap requests with a
+    hosted model behind it. get_backend(name, model) supplies shared clients.
+    """
+
+    def __init__(self, routes, get_backend):
+        self.routes = routes
+        self.get_backend = get_backend
+
+    def candidates(self, task, prompt_tokens):
+        return [
+            self.get_backend(route["backend"], route["model"])
+            for route in self.routes if route_matches(route, task, prompt_tokens)
+        ]
+
+    def _candidates_or_raise(self, task, prompt_tokens):
+        backends = self.candidates(task, prompt_tokens)
+        if not backends:
+            raise ValueError(f"No LLM route for task {task!r} with {prompt_tokens} prompt tokens")
+        return backends
+
+    async def complete(self, task, prompt, prompt_tokens):
+        """Return (backend, text) from the first reachable matching backend."""
+        backends = self._candidates_or_raise(task, prompt_tokens)
+        for backend in backends:
+            try:
+                return backend, await backend.complete(prompt)
+            except BackendUnavailable as e:
+                if backend is backends[-1]:
+                    raise
+                logger.warning(f"{e}; falling back")
+
+    async def stream(self, task, prompt, prompt_tokens):
+        """Yield (backend, piece) pairs; falls back only before anything was yielded."""
+        backends = self._candidates_or_raise(task, prompt_tokens)
+        for backend in backends:
+            started = False
+            try:
+                async for piece in backend.stream(prompt):
+                    started = True
+                    yield backend, piece
+                return
+            except BackendUnavailable as e:
+                if started or backend is backends[-1]:
+                    raise
+                logger.warning(f"{e}; falling back")
@@ -0,0 +1,61 @@
+import asyncio
+import threading
+import weakref
+from langchain_google_genai import ChatGoogleGenerativeAI
+from .llm_backends import GeminiBackend, OllamaBackend
+
+DEFAULT_CHAT_MODEL = "gemini-2.0-flash"
+DEFAULT_TEMPERATURE = 0.5
+
+_lock = threading.RLock()
+# Async gRPC and HTTP clients are bound to the event loop that created them, so models
+# used inside a loop are cached per loop; models used outside any loop share one slot.
+_per_loop = weakref.WeakKeyDictionary()
+_no_loop = {}
+_rag = None
+
+
+def _slot():
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return _no_loop
+    return _per_loop.setdefault(loop, {})
+
+
+def _get_or_create(key, factory):
+    with _lock:
+        slot = _slot()
+        if key not in slot:
+            slot[key] = factory()
+        return slot[key]
+
+
+def get_chat_model(model=DEFAULT_CHAT_MODEL, temperature=DEFAULT_TEMPERATURE):
+    """Return a shared chat model client, reusing its connection across requests."""
+    return _get_or_create(
+        ("model", model, temperature),
+        lambda: ChatGoogleGenerativeAI(model=model, temperature=temperature),
+    )
+
+
+def get_llm_backend(backend, model, temperature=DEFAULT_TEMPERATURE):
+    """Return a shared LLMBackend ("gemini" or "ollama") for model."""
+    def create():
+        if backend == "gemini":
+            return GeminiBackend(model, temperature, client=get_chat_model(model, temperature))
+        if backend == "ollama":
+            return OllamaBackend(model, temperature)
+        raise ValueError(f"Unknown LLM backend {backend!r}")
+    return _get_or_create(("backend", backend, model, temperature), create)
+
+
+def get_rag():
+    """Return the process-wide RAG instance, creating it on first use."""
+    global _rag
+    if _rag is None:
+        from .RAG import RAG  # RAG imports this module
+        with _lock:
+            if _rag is None:
+                _rag = RAG()
+    return _rag
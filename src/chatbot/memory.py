@@ -1,15 +1,257 @@
-class Memory:
+import time
+import sqlite3
+import threading
+from collections import deque
+from .tokens import count_tokens, truncate_to_tokens
+
+HISTORY_TOKEN_BUDGET = 1500  # recent turns kept verbatim in the prompt
+SUMMARY_TOKEN_BUDGET = 300  # rolling summary of everything older
+HISTORY_PAGE_SIZE = 50
+
+
+def render_turn(user_message, bot_response):
+    text = f"User: {user_message}\n"
+    if bot_response:
+        text += f"Bot: {bot_response}\n"
+    return text
+
+
+class MemoryBackend:
+    """Append-only storage of conversation turns, addressed by session id and turn number."""
+
+    def append(self, session_id, user_message, bot_response):
+        """Store a turn and return its turn number (0-based)."""
+        raise NotImplementedError
+
+    def get_turns(self, session_id, offset=0, limit=HISTORY_PAGE_SIZE):
+        """Return up to limit turns starting at turn number offset, oldest first."""
+        raise NotImplementedError
+
+    def get_recent(self, session_id, limit=HISTORY_PAGE_SIZE):
+        """Return the last limit turns, oldest first."""
+        raise NotImplementedError
+
+    def count(self, session_id):
+        raise NotImplementedError
+
+    def save_summary(self, session_id, summary, summarized_through):
+        raise NotImplementedError
+
+    def load_summary(self, session_id):
+        """Return (summary, last summarized turn number or -1)."""
+        raise NotImplementedError
+
+    def clear(self, session_id):
+        raise NotImplementedError
+
+
+class InMemoryBackend(MemoryBackend):
+    """Process-local backend; history is lost when the process exits."""
+
     def __init__(self):
-        self.conversation_history = []
+        self._turns = {}
+        self._summaries = {}
+        self._lock = threading.Lock()
+
+    def append(self, session_id, user_message, bot_response):
+        with self._lock:
+            turns = self._turns.setdefault(session_id, [])
+            turns.append({'turn': len(turns), 'user': user_message, 'bot': bot_response})
+            return len(turns) - 1
+
+    def get_turns(self, session_id, offset=0, limit=HISTORY_PAGE_SIZE):
+        return list(self._turns.get(session_id, [])[offset:offset + limit])
+
+    def get_recent(self, session_id, limit=HISTORY_PAGE_SIZE):
+        return list(self._turns.get(session_id, [])[-limit:]) if limit else []
+
+    def count(self, session_id):
+        return len(self._turns.get(session_id, []))
+
+    def save_summary(self, session_id, summary, summarized_through):
+        self._summaries[session_id] = (summary, summarized_through)
+
+    def load_summary(self, session_id):
+        return self._summaries.get(session_id, ("", -1))
+
+    def clear(self, session_id):
+        with self._lock:
+            self._turns.pop(session_id, None)
+            self._summaries.pop(session_id, None)
+
+
+class SQLiteMemoryBackend(MemoryBackend):
+    """Durable backend shared by all sessions of a process (and other processes, via WAL).
+
+    Turns are keyed by (session_id, turn), so appends and page reads touch only
+    the rows they need regardless of how long a session has run.
+    """
+
+    def __init__(self, path):
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS turns ("
+                "session_id TEXT NOT NULL, turn INTEGER NOT NULL, user TEXT NOT NULL, bot TEXT, "
+                "created_at REAL NOT NULL, PRIMARY KEY (session_id, turn)) WITHOUT ROWID"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS summaries ("
+                "session_id TEXT PRIMARY KEY, summary TEXT NOT NULL, summarized_through INTEGER NOT NULL)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def _rows_to_turns(rows):
+        return [{'turn': turn, 'user': user, 'bot': bot} for turn, user, bot in rows]
+
+    def append(self, session_id, user_message, bot_response):
+        with self._lock, self._conn:
+            # BEGIN IMMEDIATE so concurrent writers in other processes cannot take the same turn number
+            self._conn.execute("BEGIN IMMEDIATE")
+            turn = self._conn.execute(
+                "SELECT COALESCE(MAX(turn), -1) + 1 FROM turns WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+            self._conn.execute(
+                "INSERT INTO turns (session_id, turn, user, bot, created_at) VALUES (?, ?, ?, ?, ?)",
+                (session_id, turn, user_message, bot_response, time.time()),
+            )
+            return turn
+
+    def get_turns(self, session_id, offset=0, limit=HISTORY_PAGE_SIZE):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT turn, user, bot FROM turns WHERE session_id = ? AND turn >= ? ORDER BY turn LIMIT ?",
+                (session_id, offset, limit),
+            ).fetchall()
+        return self._rows_to_turns(rows)
+
+    def get_recent(self, session_id, limit=HISTORY_PAGE_SIZE):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT turn, user, bot FROM turns WHERE session_id = ? ORDER BY turn DESC LIMIT ?",
+                (session_id, limit),
+            ).fetchall()
+        return self._rows_to_turns(reversed(rows))
+
+    def count(self, session_id):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COALESCE(MAX(turn), -1) + 1 FROM turns WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+
+    def save_summary(self, session_id, summary, summarized_through):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries (session_id, summary, summarized_through) VALUES (?, ?, ?)",
+                (session_id, summary, summarized_through),
+            )
+
+    def load_summary(self, session_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary, summarized_through FROM summaries WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row if row else ("", -1)
+
+    def clear(self, session_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM summaries WHERE session_id = ?", (session_id,))
+
+
+class Memory:
+    """One session's conversation history with a prompt rendering that stays within a token budget.
+
+    Turns are persisted through a MemoryBackend and rendered once when added.
+    The most recent turns are kept verbatim up to token_budget; older turns are
+    queued to be folded into a rolling summary (see pending_turns /
+    fold_summary), so the prompt stays flat in size however long the session runs.
+    """
+
+    def __init__(self, session_id="default", backend=None,
+                 token_budget=HISTORY_TOKEN_BUDGET, summary_budget=SUMMARY_TOKEN_BUDGET):
+        self.session_id = session_id
+        self.backend = backend or InMemoryBackend()
+        self.token_budget = token_budget
+        self.summary_budget = summary_budget
+        # At most one summary refresh per session at a time, shared by every Chatbot using this Memory
+        self.summary_task = None
+        self._reset()
+        self._load()
+
+    def _reset(self):
+        self._recent = deque()
+        self._recent_tokens = 0
+        self._pending = deque()
+        self.summary = ""
+        self._summarized_through = -1
+        self._rendered = None
+
+    def _load(self):
+        # Rebuild the prompt window from the last page of turns only
+        self.summary, self._summarized_through = self.backend.load_summary(self.session_id)
+        for turn in self.backend.get_recent(self.session_id, HISTORY_PAGE_SIZE):
+            if turn['turn'] > self._summarized_through:
+                self._push(turn['turn'], render_turn(turn['user'], turn['bot']))
+
+    def _push(self, turn, text):
+        tokens = count_tokens(text)
+        self._recent.append((turn, text, tokens))
+        self._recent_tokens += tokens
+        # Always keep the latest turn, even if it alone exceeds the budget
+        while self._recent_tokens > self.token_budget and len(self._recent) > 1:
+            evicted_turn, evicted, evicted_tokens = self._recent.popleft()
+            self._recent_tokens -= evicted_tokens
+            self._pending.append((evicted_turn, evicted))
+        self._rendered = None
 
     def add_message(self, user_message, bot_response):
-        self.conversation_history.append({
-            'user': user_message,
-            'bot': bot_response
-        })
+        turn = self.backend.append(self.session_id, user_message, bot_response)
+        self._push(turn, render_turn(user_message, bot_response))
+
+    def get_history(self, offset=0, limit=HISTORY_PAGE_SIZE):
+        """Return a page of turns (dicts with 'turn', 'user' and 'bot'), oldest first."""
+        return self.backend.get_turns(self.session_id, offset, limit)
+
+    def get_recent_history(self, limit=HISTORY_PAGE_SIZE):
+        return self.backend.get_recent(self.session_id, limit)
+
+    def __len__(self):
+        return self.backend.count(self.session_id)
+
+    def get_history_string(self):
+        """History for the prompt: the rolling summary followed by the recent turns."""
+        if self._rendered is None:
+            parts = []
+            if self.summary:
+                parts.append(f"Summary of the earlier conversation: {self.summary}\n")
+            parts.extend(text for _, text, _ in self._recent)
+            self._rendered = "".join(parts)
+        return self._rendered
+
+    def pending_turns(self):
+        """Rendered turns that left the verbatim window and are not yet in the summary."""
+        return [text for _, text in self._pending]
+
+    def fold_summary(self, summary, folded):
+        """Replace the rolling summary after the first `folded` pending turns were summarized.
 
-    def get_history(self):
-        return self.conversation_history
+        Returns False, changing nothing, if fewer turns are pending than that
+        (another refresh or clear_memory got there first).
+        """
+        if folded > len(self._pending):
+            return False
+        self.summary = truncate_to_tokens(summary.strip(), self.summary_budget)
+        for _ in range(folded):
+            self._summarized_through = self._pending.popleft()[0]
+        self.backend.save_summary(self.session_id, self.summary, self._summarized_through)
+        self._rendered = None
+        return True
 
     def clear_memory(self):
-        self.conversation_history = []
\ No newline at end of file
+        self.backend.clear(self.session_id)
+        self._reset()
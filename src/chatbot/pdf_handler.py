@@ -1,10 +1,98 @@
+import os
+import hashlib
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from cachetools import LRUCache
 from PyPDF2 import PdfReader
 
+PAGE_CACHE_SIZE = 20000
+PARALLEL_MIN_PAGES = 8  # Below this, a process pool costs more than it saves
+PAGES_PER_TASK = 4
+
+# Extracted text keyed by (file hash, page number)
+_page_cache = LRUCache(maxsize=PAGE_CACHE_SIZE)
+_page_cache_lock = threading.Lock()
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    # PyPDF2 is pure Python, so pages are extracted in worker processes to escape the GIL.
+    # Spawned rather than forked: the parent runs threads and gRPC clients.
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=os.cpu_count(), mp_context=multiprocessing.get_context("spawn")
+            )
+        return _executor
+
+
+def _extract_pages(path, page_numbers):
+    """Worker: extract the given 1-based page numbers from the PDF at path."""
+    reader = PdfReader(path)
+    return [(number, reader.pages[number - 1].extract_text() or "") for number in page_numbers]
+
+
+def _read_bytes(file):
+    if isinstance(file, (str, os.PathLike)):
+        with open(file, "rb") as f:
+            return f.read()
+    if hasattr(file, "seek"):
+        file.seek(0)
+    return file.read()
+
+
+def iter_pdf_pages(file):
+    """Yield (page_number, text) for each page in order, extracting pages in parallel.
+
+    Page numbers are 1-based. Pages already extracted from a file with the same
+    content are served from the page cache.
+    """
+    data = _read_bytes(file)
+    file_hash = hashlib.sha256(data).hexdigest()
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
+        tmp.write(data)
+        path = tmp.name
+    try:
+        page_count = len(PdfReader(path).pages)
+        with _page_cache_lock:
+            cached = {
+                number: _page_cache[(file_hash, number)]
+                for number in range(1, page_count + 1)
+                if (file_hash, number) in _page_cache
+            }
+        missing = [number for number in range(1, page_count + 1) if number not in cached]
+
+        pending = {}
+        if len(missing) >= PARALLEL_MIN_PAGES:
+            executor = _get_executor()
+            for i in range(0, len(missing), PAGES_PER_TASK):
+                batch = missing[i:i + PAGES_PER_TASK]
+                future = executor.submit(_extract_pages, path, batch)
+                for number in batch:
+                    pending[number] = future
+
+        for number in range(1, page_count + 1):
+            if number in cached:
+                yield number, cached[number]
+                continue
+            if number in pending:
+                results = dict(pending[number].result())
+            else:
+                results = dict(_extract_pages(path, [number]))
+            with _page_cache_lock:
+                for page_number, text in results.items():
+                    _page_cache[(file_hash, page_number)] = text
+            yield number, results[number]
+    finally:
+        os.unlink(path)
+
+
 def load_pdf(file_path):
-    reader = PdfReader(file_path)
-    text = ""
-    for page in reader.pages:
-        text += page.extract_text() + "\n"
+    text = "\n".join(text for _, text in iter_pdf_pages(file_path))
     return text.strip()
 
 async def summarize_pdf(text, model):
@@ -19,4 +107,4 @@ def extract_text_from_pdf(file_path):
 def answer_question_from_pdf(question, pdf_text, model):
     # Implement question-answering logic using the LLM model
     answer = model.answer(question, pdf_text)
-    return answer
\ No newline at end of file
+    return answer
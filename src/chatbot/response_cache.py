@@ -0,0 +1,104 @@
+import re
+import threading
+import hashlib
+import numpy as np
+from cachetools import TTLCache
+
+# Words that can differ between two questions with the same answer
+_STOPWORDS = frozenset(
+    "a an the is are was were be been am do does did of in on at to for from with and or "
+    "what which who whom whose how when where why can could would should will please tell show give "
+    "me my i you your we our us".split()
+)
+
+
+def normalize_question(question):
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip("?!. ")
+
+
+def content_terms(question):
+    """The normalized question's terms other than stopwords, e.g. {"revenue", "2020"}."""
+    return frozenset(term for term in re.findall(r"\w+", normalize_question(question)) if term not in _STOPWORDS)
+
+
+class ResponseCache:
+    """TTL + LRU cache of final answers with optional semantic matching.
+
+    Answers are scoped to the index generation they were produced from, so
+    publishing new documents invalidates them, and to the conversation history.
+    The cache is shared by every session in the process, and an answer may draw
+    on the history however the question is phrased, so only answers given
+    without any history are shared between conversations. Within a scope an exact normalized
+    question match is tried first, then the closest cached question whose query
+    embedding has cosine similarity of at least similarity_threshold and whose
+    content_terms are the same. Embeddings alone rate questions that differ
+    only in a year or a name as near-identical, so similarity_threshold
+    defaults to None (no semantic matching).
+    """
+
+    def __init__(self, maxsize=256, ttl=3600, similarity_threshold=None):
+        self.similarity_threshold = similarity_threshold
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def scope(self, generation, history_str=""):
+        history_key = ""
+        if history_str:
+            history_key = hashlib.sha256(history_str.encode("utf-8")).hexdigest()
+        return f"{generation}:{history_key}"
+
+    def get(self, question, scope):
+        with self._lock:
+            entry = self._entries.get((scope, normalize_question(question)))
+            if entry is not None:
+                self.hits += 1
+                return entry[0]
+        return None
+
+    def get_similar(self, question, query_vector, scope):
+        if self.similarity_threshold is None:
+            with self._lock:
+                self.misses += 1
+            return None
+        query = np.array(query_vector, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        terms = content_terms(question)
+        best_answer, best_score = None, self.similarity_threshold
+        with self._lock:
+            for (entry_scope, _), (answer, vector, entry_terms) in list(self._entries.items()):
+                if entry_scope != scope or vector is None or entry_terms != terms:
+                    continue
+                score = float(np.dot(query, vector))
+                if score >= best_score:
+                    best_answer, best_score = answer, score
+            if best_answer is None:
+                self.misses += 1
+            else:
+                self.semantic_hits += 1
+        return best_answer
+
+    def put(self, question, scope, answer, query_vector=None):
+        vector = None
+        if query_vector is not None:
+            vector = np.array(query_vector, dtype=np.float32)
+            vector /= np.linalg.norm(vector) or 1.0
+        with self._lock:
+            self._entries[(scope, normalize_question(question))] = (answer, vector, content_terms(question))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.semantic_hits + self.misses
+        return {
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.semantic_hits) / lookups if lookups else 0.0,
+            "entries": len(self._entries),
+        }
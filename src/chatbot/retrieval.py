@@ -0,0 +1,94 @@
+import threading
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RRF_K = 60  # standard reciprocal-rank-fusion damping constant
+
+
+def reciprocal_rank_fusion(rankings, k=RRF_K):
+    """Fuse several ranked id lists into one, best first."""
+    scores = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+class CrossEncoderReranker:
+    """Reorders candidate chunks with a local cross-encoder running on CPU.
+
+    The transformers model is loaded on first use and shared by all callers.
+    """
+
+    def __init__(self, model_name="cross-encoder/ms-marco-MiniLM-L-6-v2", batch_size=16):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self._model = None
+        self._tokenizer = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._model is None:
+                from transformers import AutoModelForSequenceClassification, AutoTokenizer
+                self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+                self._model = AutoModelForSequenceClassification.from_pretrained(self.model_name).eval()
+                logger.info(f"Loaded reranker {self.model_name}")
+        return self._tokenizer, self._model
+
+    def rerank(self, question, docs):
+        if not docs:
+            return docs
+        import torch
+        tokenizer, model = self._load()
+        scores = []
+        with torch.no_grad():
+            for i in range(0, len(docs), self.batch_size):
+                batch = docs[i:i + self.batch_size]
+                inputs = tokenizer(
+                    [question] * len(batch), [doc.page_content for doc in batch],
+                    padding=True, truncation=True, max_length=512, return_tensors="pt",
+                )
+                scores.extend(model(**inputs).logits[:, 0].tolist())
+        order = np.argsort(scores)[::-1]
+        return [docs[i] for i in order]
+
+
+class HybridRetriever:
+    """Retrieves chunks by fusing dense FAISS search with local BM25 search.
+
+    mode is "hybrid" (reciprocal-rank fusion of both), "dense" (FAISS only) or
+    "lexical" (BM25 only, which needs no embedding call and so no network).
+    Lexical search runs on the docstore's SQLite full-text index.
+    candidates results are taken from each retriever, fused, optionally
+    reranked, and the top k returned.
+    """
+
+    def __init__(self, index_manager, embeddings, mode="hybrid", k=3, candidates=10, reranker=None):
+        self.index_manager = index_manager
+        self.embeddings = embeddings
+        self.mode = mode
+        self.k = k
+        self.candidates = candidates
+        self.reranker = reranker
+
+    def _dense_ids(self, vector_store, question):
+        vector = np.array([self.embeddings.embed_query(question)], dtype=np.float32)
+        _, labels = vector_store.index.search(vector, self.candidates)
+        return [vector_store.index_to_docstore_id[label] for label in labels[0] if label != -1]
+
+    def retrieve(self, question):
+        vector_store = self.index_manager.get()
+        rankings = []
+        if self.mode in ("hybrid", "lexical"):
+            hits = vector_store.docstore.search_text(question, self.candidates)
+            rankings.append([doc_id for doc_id, _ in hits])
+        if self.mode in ("hybrid", "dense"):
+            rankings.append(self._dense_ids(vector_store, question))
+        doc_ids = reciprocal_rank_fusion(rankings)[:self.candidates]
+        docs = [vector_store.docstore.search(doc_id) for doc_id in doc_ids]
+        if self.reranker is not None:
+            docs = self.reranker.rerank(question, docs)
+        return docs[:self.k]
@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import logging
+from cachetools import LRUCache
+from langchain.prompts import PromptTemplate
+from .index_manager import content_hash
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_CHUNK_SIZE = 12000  # characters per map step, well inside the model's context window
+SUMMARY_CHUNK_OVERLAP = 200
+SUMMARY_MAX_CONCURRENCY = 4
+SUMMARY_CACHE_SIZE = 4096
+
+MAP_PROMPT = PromptTemplate(
+    template=(
+        "Summarize the following part of a larger document. Keep key facts, figures and names.\n\n"
+        "{text}\n\nSUMMARY:"
+    ),
+    input_variables=["text"],
+)
+REDUCE_PROMPT = PromptTemplate(
+    template=(
+        "The following are summaries of consecutive parts of one document. "
+        "Combine them into a single coherent summary.\n\n{text}\n\nSUMMARY:"
+    ),
+    input_variables=["text"],
+)
+
+# Shared by all summarizers so an edited document only re-summarizes changed chunks
+_summary_cache = LRUCache(maxsize=SUMMARY_CACHE_SIZE)
+_summary_cache_lock = threading.Lock()
+
+
+class MapReduceSummarizer:
+    """Summarizes text of any length by summarizing chunks, then their summaries.
+
+    Text that fits in one chunk is summarized directly with single_prompt.
+    Longer text is split with RAG.get_text_chunks, the chunks are summarized in
+    parallel (at most max_concurrency model calls at once) and the partial
+    summaries are packed into groups and reduced until one summary remains.
+    Every model call is cached by prompt and content hash.
+    """
+
+    def __init__(
+        self,
+        rag,
+        single_prompt,
+        chunk_size=SUMMARY_CHUNK_SIZE,
+        chunk_overlap=SUMMARY_CHUNK_OVERLAP,
+        max_concurrency=SUMMARY_MAX_CONCURRENCY,
+    ):
+        self.rag = rag
+        self.single_prompt = single_prompt
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.max_concurrency = max_concurrency
+
+    async def _run(self, prompt, text, semaphore):
+        key = content_hash(prompt.template + "\0" + text)
+        with _summary_cache_lock:
+            cached = _summary_cache.get(key)
+        if cached is not None:
+            return cached
+        async with semaphore:
+            summary = await self.rag.run_prompt(prompt, task="summary", text=text)
+        with _summary_cache_lock:
+            _summary_cache[key] = summary
+        return summary
+
+    async def run(self, prompt, text):
+        """Run prompt on text once, sharing the cache of summarize()."""
+        return await self._run(prompt, text, asyncio.Semaphore(1))
+
+    def _group(self, summaries):
+        # Pack whole summaries into groups no longer than one chunk
+        groups, current, size = [], [], 0
+        for summary in summaries:
+            if current and size + len(summary) > self.chunk_size:
+                groups.append("\n\n".join(current))
+                current, size = [], 0
+            current.append(summary)
+            size += len(summary) + 2
+        groups.append("\n\n".join(current))
+        return groups
+
+    async def summarize(self, text):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        if len(text) <= self.chunk_size:
+            return await self._run(self.single_prompt, text, semaphore)
+
+        chunks = self.rag.get_text_chunks(text, self.chunk_size, self.chunk_overlap)
+        summaries = await asyncio.gather(*(self._run(MAP_PROMPT, chunk, semaphore) for chunk in chunks))
+        level = 1
+        while True:
+            groups = self._group(summaries)
+            if len(groups) == len(summaries) > 1:
+                # No two neighbouring summaries fit in one chunk, so packing made no progress. Pair them,
+                # truncated to fit, so each level at least halves the count and the loop ends.
+                half = self.chunk_size // 2
+                groups = [
+                    "\n\n".join(summary[:half] for summary in summaries[i:i + 2])
+                    for i in range(0, len(summaries), 2)
+                ]
+            logger.info(f"Summarization level {level}: reducing {len(summaries)} summaries in {len(groups)} groups")
+            summaries = await asyncio.gather(*(self._run(REDUCE_PROMPT, group, semaphore) for group in groups))
+            if len(summaries) == 1:
+                return summaries[0]
+            level += 1
@@ -0,0 +1,69 @@
+import functools
+import logging
+
+logger = logging.getLogger(__name__)
+
+TOKENIZER_ENCODING = "cl100k_base"
+_CHARS_PER_TOKEN = 4  # Fallback estimate when the tokenizer cannot be loaded
+COUNT_CACHE_MAX_CHARS = 4096  # Only texts up to this length (questions, retrieved chunks) are cached
+
+
+@functools.lru_cache(maxsize=1)
+def get_tokenizer():
+    """Load the BPE tokenizer once per process; None if it is unavailable (e.g. offline)."""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(TOKENIZER_ENCODING)
+    except Exception as e:
+        logger.warning(f"Tokenizer unavailable, estimating tokens from length: {e}")
+        return None
+
+
+def count_tokens(text):
+    """Number of tokens in text.
+
+    Short texts such as retrieved chunks are counted repeatedly and cached;
+    long ones (whole prompts, documents) are rarely seen twice and would only
+    pin their strings in the cache.
+    """
+    if not text:
+        return 0
+    if len(text) <= COUNT_CACHE_MAX_CHARS:
+        return _count_short(text)
+    return _count(text)
+
+
+@functools.lru_cache(maxsize=8192)
+def _count_short(text):
+    return _count(text)
+
+
+def _count(text):
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return -(-len(text) // _CHARS_PER_TOKEN)
+    return len(tokenizer.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Return the longest prefix of text that fits in max_tokens."""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return text[:max_tokens * _CHARS_PER_TOKEN]
+    return tokenizer.decode(tokenizer.encode(text, disallowed_special=())[:max_tokens])
+
+
+def tail_to_tokens(text, max_tokens):
+    """Return the longest suffix of text that fits in max_tokens."""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    tokenizer = get_tokenizer()
+    if tokenizer is None:
+        return text[-max_tokens * _CHARS_PER_TOKEN:]
+    return tokenizer.decode(tokenizer.encode(text, disallowed_special=())[-max_tokens:])